@@ -0,0 +1,139 @@
+"""Micro-benchmarks for the conversion pipeline in file_agent.py.
+
+Runs offline against the files in test_files/. Usage:
+
+    python benchmark.py
+    python benchmark.py --live   # also time real vision-model calls (needs .env)
+"""
+import io
+import os
+import sys
+import time
+import base64
+import statistics
+
+from markitdown import MarkItDown, StreamInfo
+
+import file_agent
+
+TEST_FILES_DIR = 'test_files'
+DOCUMENT_EXTENSIONS = ('.docx', '.html', '.pdf', '.pptx', '.xlsx')
+
+def load_test_files(extensions=DOCUMENT_EXTENSIONS):
+    """Read test files into memory, keyed by file name."""
+    files = {}
+    for name in sorted(os.listdir(TEST_FILES_DIR)):
+        if name.startswith('.') or not name.endswith(extensions):
+            continue
+        with open(os.path.join(TEST_FILES_DIR, name), 'rb') as f:
+            files[name] = f.read()
+    return files
+
+def time_call(fn, rounds):
+    """Return the median wall time of fn() in milliseconds."""
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def benchmark_markitdown_setup(rounds=20):
+    """Compare building a MarkItDown per file against the shared instance registry."""
+    print("\nMarkItDown setup overhead (median ms per file)")
+    print(f"{'file':<12} {'per-file instance':>18} {'shared instance':>16}")
+
+    setup_fresh = time_call(lambda: MarkItDown(), rounds)
+    setup_shared = time_call(lambda: file_agent.get_markitdown(None, use_llm=False), rounds)
+    print(f"{'(setup only)':<12} {setup_fresh:>18.3f} {setup_shared:>16.3f}")
+
+    for name, content in load_test_files().items():
+        extension = os.path.splitext(name)[1]
+
+        def convert_fresh():
+            converter = MarkItDown()
+            converter.convert_stream(
+                io.BytesIO(content),
+                stream_info=StreamInfo(extension=extension)
+            )
+
+        def convert_shared():
+            file_agent.convert_file_sync(content, None, extension=extension, use_llm=False)
+
+        fresh = time_call(convert_fresh, rounds)
+        shared = time_call(convert_shared, rounds)
+        print(f"{name:<12} {fresh:>18.3f} {shared:>16.3f}")
+
+def benchmark_cache_compression(rounds=50):
+    """Compare stored size and decode cost of each document_cache codec."""
+    codecs = ['zlib'] + (['zstd'] if file_agent.zstandard is not None else [])
+    print("\nCached markdown compression (stored bytes as % of raw, median decode ms)")
+    print(f"{'file':<12} {'raw bytes':>10}" + "".join(f" {codec + ' %':>9} {codec + ' ms':>9}" for codec in codecs))
+
+    for name, content in load_test_files().items():
+        extension = os.path.splitext(name)[1]
+        markdown = file_agent.convert_file_sync(content, None, extension=extension, use_llm=False)
+        raw_size = len(markdown.encode('utf-8'))
+        row = f"{name:<12} {raw_size:>10}"
+        for codec in codecs:
+            stored, used_codec = file_agent.encode_markdown(markdown, codec)
+            decode_ms = time_call(lambda: file_agent.decode_markdown(stored, used_codec), rounds)
+            row += f" {100 * len(stored) / raw_size:>8.1f}% {decode_ms:>9.3f}"
+        print(row)
+
+def make_phone_photo(source, size=(4032, 3024)):
+    """A 12-megapixel JPEG built from a test image, with sensor-like noise so it compresses like a photo."""
+    from PIL import Image
+    with Image.open(io.BytesIO(source)) as image:
+        photo = image.convert("RGB").resize(size)
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    output = io.BytesIO()
+    Image.blend(photo, noise, 0.08).save(output, format="JPEG", quality=95)
+    return output.getvalue()
+
+def benchmark_vlm_image_preparation(rounds=5, live=False):
+    """Compare vision-model payloads before and after downscaling and re-encoding."""
+    source = load_test_files(('.jpg',))['test.jpg']
+    images = {'test.jpg': source, '12MP photo': make_phone_photo(source)}
+    settings = (
+        file_agent.VLM_IMAGE_MAX_DIMENSION,
+        file_agent.VLM_IMAGE_FORMAT,
+        file_agent.VLM_IMAGE_QUALITY
+    )
+    print(f"\nVision-model image payload (max {settings[0]}px, {settings[1]} q{settings[2]})")
+    print(f"{'image':<12} {'original KB':>12} {'sent KB':>9} {'base64 KB':>10} {'prepare ms':>11}")
+
+    prepared = {}
+    for name, blob in images.items():
+        prepare = lambda: file_agent.prepare_vlm_image_sync(blob, "image/jpeg", ".jpg", *settings)
+        prepare_ms = time_call(prepare, rounds)
+        prepared[name] = prepare()
+        sent = prepared[name][0]
+        print(f"{name:<12} {len(blob) / 1024:>12.1f} {len(sent) / 1024:>9.1f} "
+              f"{len(base64.b64encode(sent)) / 1024:>10.1f} {prepare_ms:>11.1f}")
+
+    if not live:
+        return
+    model = os.getenv("OPENROUTER_VLM_MODEL")
+    print(f"\nEnd-to-end caption latency with {model} (seconds, one call each)")
+    print(f"{'image':<12} {'original':>9} {'prepared':>9}")
+    for name, blob in images.items():
+        timings = []
+        for payload, mimetype, extension in [(blob, "image/jpeg", ".jpg"), prepared[name]]:
+            start = time.perf_counter()
+            file_agent.llm_caption(
+                io.BytesIO(payload),
+                file_agent.StreamInfo(mimetype=mimetype, extension=extension),
+                client=file_agent.openai_client,
+                model=model
+            )
+            timings.append(time.perf_counter() - start)
+        print(f"{name:<12} {timings[0]:>9.2f} {timings[1]:>9.2f}")
+
+def main():
+    benchmark_markitdown_setup()
+    benchmark_cache_compression()
+    benchmark_vlm_image_preparation(live='--live' in sys.argv)
+
+if __name__ == "__main__":
+    main()
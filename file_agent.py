@@ -1,7 +1,8 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator
 from fastapi import FastAPI, HTTPException, Security, Depends, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from supabase import create_client, Client
 from pydantic import BaseModel
 from dotenv import load_dotenv
@@ -9,14 +10,69 @@ from pathlib import Path
 import sys
 import os
 import base64
-from openai import OpenAI
-from markitdown import MarkItDown
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError
+import httpx
+from markitdown import MarkItDown, StreamInfo, __version__ as markitdown_version
+from markitdown.converters import PptxConverter
+from markitdown.converters._llm_caption import llm_caption
 import hashlib
-from datetime import datetime
+import numpy as np
+import json
+import zlib
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
 import logging
 import imghdr
 import io
 import re
+import asyncio
+try:
+    import zstandard
+except ImportError:  # Optional: only needed for CACHE_COMPRESSION=zstd
+    zstandard = None
+try:
+    import pdfminer
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdftypes import resolve1
+    import pdfplumber
+    from markitdown.converters._pdf_converter import (
+        _extract_form_content_from_words,
+        _merge_partial_numbering_lines
+    )
+    pdf_import_error = None
+except ImportError as e:  # Optional: only needed for page-parallel PDF conversion
+    PDFPage = None
+    pdf_import_error = e
+try:
+    import pptx
+except ImportError:  # Optional: only needed for concurrent PPTX captioning
+    pptx = None
+try:
+    import openpyxl
+except ImportError:  # Optional: only needed for streamed XLSX conversion
+    openpyxl = None
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Optional: only needed to downscale images sent to the vision model
+    Image = None
+import functools
+import contextvars
+from types import SimpleNamespace
+import mimetypes
+import tempfile
+import threading
+import uuid
+import random
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from python_multipart.multipart import MultipartParser, parse_options_header
 
 # Configure logging
 logging.basicConfig(
@@ -32,23 +88,74 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv(override=True)  # Force reload environment variables
 
+def create_openrouter_client() -> OpenAI:
+    """Create an OpenAI-compatible client pointed at OpenRouter."""
+    return OpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        default_headers={
+            "HTTP-Referer": "http://localhost:8001",  # Required for OpenRouter
+            "X-Title": "MarkItDown App",  # Optional, for OpenRouter analytics
+        }
+    )
+
 # Initialize FastAPI app and OpenRouter client
 app = FastAPI()
 security = HTTPBearer()
-openai_client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENROUTER_API_KEY"),
-    default_headers={
-        "HTTP-Referer": "http://localhost:8001",  # Required for OpenRouter
-        "X-Title": "MarkItDown App",  # Optional, for OpenRouter analytics
-    }
-)
+openai_client = create_openrouter_client()
 
-# Initialize MarkItDown globally
-md = MarkItDown(
-    llm_client=openai_client,
-    llm_model=os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct")
-)
+def get_image_key(blob: bytes) -> str:
+    return hashlib.sha256(blob).hexdigest()
+
+class PrecomputedCaptionClient:
+    """Stands in for the OpenAI client during a conversion, answering caption requests from precomputed captions."""
+
+    def __init__(self, client, captions: Dict[str, Optional[str]]):
+        self._client = client
+        self._captions = captions
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: List[Dict[str, Any]], **kwargs):
+        key = None
+        try:
+            data_uri = messages[0]['content'][1]['image_url']['url']
+            key = get_image_key(base64.b64decode(data_uri.split(',', 1)[1]))
+        except (KeyError, IndexError, TypeError, ValueError):
+            pass
+        if key in self._captions:
+            caption = self._captions[key]
+            if caption is None:
+                raise RuntimeError("Image captioning failed")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=caption))])
+        return self._client.chat.completions.create(model=model, messages=messages, **kwargs)
+
+# Shared MarkItDown instances keyed by (model, use_llm). Building one
+# registers every converter, so instances are created once and reused.
+_markitdown_instances: Dict[tuple, MarkItDown] = {}
+_markitdown_lock = threading.Lock()
+
+def get_markitdown(llm_model: Optional[str], use_llm: bool = True) -> MarkItDown:
+    """Return the shared MarkItDown instance for a model, building it on first use."""
+    key = (llm_model if use_llm else None, use_llm)
+    converter = _markitdown_instances.get(key)
+    if converter is None:
+        with _markitdown_lock:
+            converter = _markitdown_instances.get(key)
+            if converter is None:
+                if use_llm:
+                    converter = MarkItDown(
+                        llm_client=openai_client,
+                        llm_model=llm_model
+                    )
+                else:
+                    converter = MarkItDown()
+                _markitdown_instances[key] = converter
+    return converter
+
+# Pre-build instances for the configured models at startup
+for _model in {os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct"), os.getenv("OPENROUTER_VLM_MODEL")}:
+    if _model:
+        get_markitdown(_model)
 
 # Supabase setup
 supabase: Client = create_client(
@@ -64,6 +171,890 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Conversion executor settings
+CONVERSION_EXECUTOR = os.getenv("CONVERSION_EXECUTOR", "process")  # "process" or "thread"
+CONVERSION_POOL_SIZE = int(os.getenv("CONVERSION_POOL_SIZE", str(os.cpu_count() or 4)))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+EXECUTOR_QUEUE_DEPTH = int(os.getenv("EXECUTOR_QUEUE_DEPTH", "64"))
+EXECUTOR_TASK_TIMEOUT = float(os.getenv("EXECUTOR_TASK_TIMEOUT", "300"))
+# Files converted (and queried) at the same time within one request
+FILE_CONCURRENCY = int(os.getenv("FILE_CONCURRENCY", "4"))
+# Largest multipart upload accepted, enforced while the body is streamed
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+# Uploaded files stay in memory up to this size before spilling to disk
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(8 * 1024 * 1024)))
+# Part of every cache key, so upgrading MarkItDown or changing what gets
+# cached invalidates old entries
+CONVERTER_VERSION = f"markitdown-{markitdown_version}"
+CACHE_FORMAT_VERSION = "2"
+# Persistent document cache: "supabase" (document_cache table), "sqlite"
+# (local WAL-mode database) or "disk" (content-addressed files)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "supabase").lower()
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "cache/document_cache.sqlite3")
+CACHE_DIR = os.getenv("CACHE_DIR", "cache/documents")
+# In-process document cache consulted before the persistent cache
+MEMORY_CACHE_MAX_ENTRIES = int(os.getenv("MEMORY_CACHE_MAX_ENTRIES", "256"))
+MEMORY_CACHE_MAX_BYTES = int(os.getenv("MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Cache hits buffer last_accessed updates; they are written every
+# TOUCH_FLUSH_INTERVAL seconds or once TOUCH_BUFFER_SIZE hashes are waiting
+TOUCH_FLUSH_INTERVAL = float(os.getenv("TOUCH_FLUSH_INTERVAL", "30"))
+TOUCH_BUFFER_SIZE = int(os.getenv("TOUCH_BUFFER_SIZE", "500"))
+# document_cache eviction: total markdown budget, maximum idle age and how
+# often the background job runs (0 disables a limit or the job)
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+CACHE_EVICTION_INTERVAL = float(os.getenv("CACHE_EVICTION_INTERVAL", "3600"))
+# Codec for markdown stored in document_cache ("zlib", "zstd" or "none");
+# documents smaller than CACHE_COMPRESSION_MIN_BYTES are stored as-is
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zlib").lower()
+CACHE_COMPRESSION_MIN_BYTES = int(os.getenv("CACHE_COMPRESSION_MIN_BYTES", "1024"))
+# Per-query answers from /api/file-agent, keyed by document hash, normalized
+# query and model (0 entries disables the cache, 0 TTL keeps answers until evicted)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+if CACHE_COMPRESSION == "zstd" and zstandard is None:
+    logger.warning("CACHE_COMPRESSION=zstd but the zstandard package is not installed, using zlib")
+    CACHE_COMPRESSION = "zlib"
+# Background conversion jobs (/api/jobs): worker count, queued jobs and
+# payload bytes accepted before rejecting with 503, and how long finished jobs
+# stay queryable
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_QUEUE_MAX_BYTES = int(os.getenv("JOB_QUEUE_MAX_BYTES", str(512 * 1024 * 1024)))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# Documents longer than CHUNK_MAX_TOKENS (estimated) are split along headings,
+# slides and pages; query and summary calls run over at most CHUNK_CONCURRENCY
+# chunks at a time and the partial results are combined
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "6000"))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+# Queries over documents longer than CHUNK_MAX_TOKENS send only the
+# RETRIEVAL_TOP_K passages (of about RETRIEVAL_CHUNK_TOKENS each) that best
+# match the query under BM25; 0 disables retrieval and uses map-reduce
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "400"))
+RETRIEVAL_INDEX_CACHE_ENTRIES = int(os.getenv("RETRIEVAL_INDEX_CACHE_ENTRIES", "64"))
+# Retrieval is used only when the retrieved passages contain at least this
+# fraction of the query's terms (stopwords excluded); otherwise map-reduce
+RETRIEVAL_MIN_COVERAGE = float(os.getenv("RETRIEVAL_MIN_COVERAGE", "0.5"))
+# PDFs with at least PDF_PARALLEL_MIN_PAGES pages are converted in ranges of
+# PDF_PAGES_PER_TASK pages spread over the conversion pool, and each page's
+# text is cached on its own (0 disables page-parallel conversion)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+if PDF_PARALLEL_MIN_PAGES > 0 and PDFPage is None:
+    logger.warning(f"Page-parallel PDF conversion disabled, import failed: {pdf_import_error}")
+# Vision-model caption calls in flight at once across all requests
+CAPTION_CONCURRENCY = int(os.getenv("CAPTION_CONCURRENCY", "8"))
+# Images are downscaled to fit VLM_IMAGE_MAX_DIMENSION pixels and re-encoded
+# as VLM_IMAGE_FORMAT (jpeg, webp or png) before captioning (0 disables it)
+VLM_IMAGE_MAX_DIMENSION = int(os.getenv("VLM_IMAGE_MAX_DIMENSION", "1536"))
+VLM_IMAGE_FORMAT = os.getenv("VLM_IMAGE_FORMAT", "jpeg").lower()
+VLM_IMAGE_QUALITY = int(os.getenv("VLM_IMAGE_QUALITY", "85"))
+# XLSX workbooks of at least XLSX_STREAMING_MIN_BYTES are converted in one
+# streaming pass, XLSX_ROW_BATCH rows at a time (0 disables it). Their markdown
+# differs from MarkItDown's, so they are cached under their own converter version
+XLSX_STREAMING_MIN_BYTES = int(os.getenv("XLSX_STREAMING_MIN_BYTES", str(1024 * 1024)))
+XLSX_ROW_BATCH = int(os.getenv("XLSX_ROW_BATCH", "1000"))
+XLSX_STREAMING_CONVERTER = (
+    f"openpyxl-{openpyxl.__version__ if openpyxl is not None else ''}-stream-{XLSX_STREAMING_MIN_BYTES}"
+)
+# Client-side limits on OpenRouter calls, tracked per model: requests and
+# (estimated) tokens per minute, 0 disabling a bucket. Concurrency adapts
+# between LLM_MIN_CONCURRENCY and LLM_MAX_CONCURRENCY: it grows by one per
+# round of successful calls and halves on a 429, a timeout, or a call slower
+# than LLM_LATENCY_SPIKE_FACTOR times that model's recent average.
+# LLM_MODEL_LIMITS overrides the buckets per model, as JSON such as
+# {"openai/gpt-4o": {"rpm": 500, "tpm": 200000}}
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", str(LLM_POOL_SIZE)))
+LLM_LATENCY_SPIKE_FACTOR = float(os.getenv("LLM_LATENCY_SPIKE_FACTOR", "3"))
+LLM_MODEL_LIMITS = json.loads(os.getenv("LLM_MODEL_LIMITS") or "{}")
+# Async OpenRouter client used by the server: connection pool size, timeouts
+# for each attempt, and an overall deadline per call covering queueing and retries
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "300"))
+# Connection errors, timeouts, 408/409/429 and 5xx responses are retried up to
+# LLM_MAX_RETRIES times with exponential backoff and full jitter
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Query calls with prompts of at most LLM_HEDGE_MAX_TOKENS (estimated) send a
+# second request when the first is slower than the model's p95 latency over
+# its last LLM_LATENCY_WINDOW calls (0 disables hedging)
+LLM_HEDGE_MAX_TOKENS = int(os.getenv("LLM_HEDGE_MAX_TOKENS", "0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Extensions whose converters need a real file path instead of an in-memory stream
+PATH_ONLY_EXTENSIONS = {
+    ext.strip().lower() for ext in os.getenv("PATH_ONLY_EXTENSIONS", "").split(",") if ext.strip()
+}
+
+def _init_conversion_worker():
+    """Give each conversion worker process its own OpenRouter connection pool."""
+    global openai_client
+    openai_client = create_openrouter_client()
+    # Instances inherited from the parent hold its client; rebuild them lazily
+    _markitdown_instances.clear()
+
+def get_file_extension(file: Dict[str, Any]) -> str:
+    """Best-effort extension hint from the file name, falling back to the declared type."""
+    extension = os.path.splitext(file.get('name', ''))[1].lower()
+    if extension:
+        return extension
+    file_type = (file.get('type') or '').lower()
+    if '/' in file_type:
+        return mimetypes.guess_extension(file_type) or ""
+    return f".{file_type}" if file_type else ""
+
+def convert_file_sync(
+    content: bytes,
+    llm_model: str,
+    extension: str = "",
+    mimetype: str = "",
+    use_llm: bool = True,
+    captions: Optional[Dict[str, Optional[str]]] = None
+) -> str:
+    """Convert in-memory file content to markdown, reusing captions from the caption stage. Blocking."""
+    converter = get_markitdown(llm_model, use_llm)
+    options = {'use_llm': use_llm}
+    if captions is not None and use_llm:
+        options['llm_client'] = PrecomputedCaptionClient(openai_client, captions)
+    if extension in PATH_ONLY_EXTENSIONS:
+        with tempfile.NamedTemporaryFile(prefix="markitdown_", suffix=extension) as temp_file:
+            temp_file.write(content)
+            temp_file.flush()
+            result = converter.convert(temp_file.name, **options)
+    else:
+        stream_info = StreamInfo(
+            extension=extension or None,
+            mimetype=mimetype if '/' in mimetype else None
+        )
+        result = converter.convert_stream(io.BytesIO(content), stream_info=stream_info, **options)
+    return result.text_content
+
+# Formats vision models accept as-is; anything else is always re-encoded
+VLM_ACCEPTED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+
+def prepare_vlm_image_sync(
+    blob: bytes,
+    mimetype: Optional[str],
+    extension: Optional[str],
+    max_dimension: int,
+    image_format: str,
+    quality: int
+) -> tuple:
+    """Downscale and re-encode an image for the vision model, returning the original if that is not smaller. Blocking."""
+    try:
+        with Image.open(io.BytesIO(blob)) as source:
+            source_format = source.format
+            image = ImageOps.exif_transpose(source)
+            resized = max(image.size) > max_dimension
+            if resized:
+                image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, (255, 255, 255))
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            output = io.BytesIO()
+            image.save(output, format=image_format.upper(), quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Could not prepare image for the vision model, sending it unchanged: {str(e)}")
+        return blob, mimetype, extension
+    encoded = output.getvalue()
+    if resized or source_format not in VLM_ACCEPTED_FORMATS or len(encoded) < len(blob):
+        return encoded, f"image/{image_format}", ".jpg" if image_format == "jpeg" else f".{image_format}"
+    return blob, mimetype, extension
+
+def is_pptx(extension: str = "", mimetype: str = "") -> bool:
+    return extension == ".pptx" or mimetype == "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+def collect_pptx_images_sync(content: bytes) -> Dict[str, tuple]:
+    """Distinct pictures in a deck as {image key: (blob, mimetype, extension)}, found the way PptxConverter walks slides. Blocking."""
+    converter = PptxConverter()
+    images: Dict[str, tuple] = {}
+    
+    def walk(shapes):
+        for shape in shapes:
+            if converter._is_picture(shape):
+                blob, content_type, filename = converter._get_image_info(shape)
+                if blob is not None:
+                    images.setdefault(get_image_key(blob), (
+                        blob,
+                        content_type,
+                        os.path.splitext(filename)[1] if filename else None
+                    ))
+            if shape.shape_type == pptx.enum.shapes.MSO_SHAPE_TYPE.GROUP:
+                walk(shape.shapes)
+    
+    for slide in pptx.Presentation(io.BytesIO(content)).slides:
+        walk(slide.shapes)
+    return images
+
+def is_pdf(content: bytes, extension: str = "", mimetype: str = "") -> bool:
+    return extension == ".pdf" or mimetype == "application/pdf" or content[:5] == b"%PDF-"
+
+def hash_pdf_resources(resources, digest, seen: set):
+    """Feed the fonts and XObjects of a resource dictionary into digest, recursing into Form XObjects."""
+    resources = resolve1(resources) or {}
+    fonts = resolve1(resources.get('Font')) or {}
+    for name in sorted(fonts):
+        font = resolve1(fonts[name]) or {}
+        digest.update(f"font {name}={resolve1(font.get('BaseFont'))}".encode('utf-8'))
+        to_unicode = resolve1(font.get('ToUnicode'))
+        if hasattr(to_unicode, 'get_data'):
+            digest.update(to_unicode.get_data())
+    xobjects = resolve1(resources.get('XObject')) or {}
+    for name in sorted(xobjects):
+        digest.update(f"xobject {name}".encode('utf-8'))
+        objid = getattr(xobjects[name], 'objid', None)
+        if objid is not None:
+            if objid in seen:
+                continue
+            seen.add(objid)
+        xobject = resolve1(xobjects[name])
+        if not hasattr(xobject, 'get_rawdata'):
+            continue
+        digest.update(repr([resolve1(xobject.get(key)) for key in ('Subtype', 'BBox', 'Matrix', 'Width', 'Height')]).encode('utf-8'))
+        digest.update(xobject.get_rawdata() or b"")
+        hash_pdf_resources(xobject.get('Resources'), digest, seen)
+
+def hash_pdf_page(page) -> str:
+    """Hash what determines a page's extracted text: content streams, geometry, fonts and XObjects."""
+    digest = hashlib.sha256()
+    for stream in page.contents:
+        digest.update(stream.get_data())
+    digest.update(repr((page.mediabox, page.rotate)).encode('utf-8'))
+    hash_pdf_resources(page.resources, digest, set())
+    return digest.hexdigest()
+
+def count_pdf_pages_sync(content: bytes) -> int:
+    """Page count from the PDF's page tree, without parsing any page. Blocking."""
+    document = PDFDocument(PDFParser(io.BytesIO(content)))
+    return int(resolve1(resolve1(document.catalog['Pages'])['Count']))
+
+def hash_pdf_pages_sync(content: bytes) -> List[str]:
+    """Hash every page of a PDF, in page order. Blocking; run it through the conversion executor."""
+    return [hash_pdf_page(page) for page in PDFPage.get_pages(io.BytesIO(content))]
+
+def extract_pdf_pages_sync(content: bytes, page_numbers: List[int]) -> List[str]:
+    """pdfminer text of the given zero-based pages, each ending in a form feed as in whole-document extraction. Blocking."""
+    manager = PDFResourceManager()
+    texts = []
+    for page in PDFPage.get_pages(io.BytesIO(content), pagenos=set(page_numbers)):
+        output = io.StringIO()
+        device = TextConverter(manager, output, laparams=LAParams())
+        try:
+            PDFPageInterpreter(manager, device).process_page(page)
+        finally:
+            device.close()
+        texts.append(output.getvalue())
+    return texts
+
+def extract_pdf_layout_sync(content: bytes, page_numbers: List[int]) -> List[str]:
+    """MarkItDown's pdfplumber pass over the given zero-based pages, as JSON {"form", "text"} per page. Blocking."""
+    results = []
+    with pdfplumber.open(io.BytesIO(content), pages=[number + 1 for number in page_numbers]) as pdf:
+        for page in pdf.pages:
+            form_content = _extract_form_content_from_words(page)
+            if form_content is not None:
+                results.append(json.dumps({'form': True, 'text': form_content}))
+            else:
+                results.append(json.dumps({'form': False, 'text': page.extract_text() or ""}))
+            page.close()
+    return results
+
+def is_xlsx(extension: str = "", mimetype: str = "") -> bool:
+    return extension == ".xlsx" or mimetype == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def uses_xlsx_streaming(content: bytes, extension: str = "", mimetype: str = "") -> bool:
+    return (XLSX_STREAMING_MIN_BYTES > 0 and openpyxl is not None
+            and len(content) >= XLSX_STREAMING_MIN_BYTES and is_xlsx(extension, mimetype))
+
+def format_table_cell(value) -> str:
+    if value is None:
+        return ""
+    return str(value).replace("|", "\\|").replace("\r", " ").replace("\n", " ")
+
+def format_table_row(values) -> str:
+    return "| " + " | ".join(format_table_cell(value) for value in values) + " |\n"
+
+def convert_xlsx_sync(content: bytes, batch_rows: int, batches) -> None:
+    """Stream every worksheet as markdown onto the batches queue, batch_rows rows per item, then None. Blocking."""
+    workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        for number, sheet_name in enumerate(workbook.sheetnames):
+            # Sheets are separated by a blank line, as in MarkItDown's layout
+            batch = ["\n" if number else "", f"## {sheet_name}\n"]
+            rows = workbook[sheet_name].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is not None:
+                width = len(header)
+                batch.append(format_table_row(
+                    f"Unnamed: {k}" if value is None else value for k, value in enumerate(header)
+                ))
+                batch.append("| " + " | ".join(["---"] * width) + " |\n")
+                rows_in_batch = 0
+                for row in rows:
+                    if all(value is None for value in row):
+                        continue
+                    batch.append(format_table_row((tuple(row) + (None,) * width)[:width]))
+                    rows_in_batch += 1
+                    if rows_in_batch >= batch_rows:
+                        batches.put("".join(batch))
+                        batch, rows_in_batch = [], 0
+            if batch:
+                batches.put("".join(batch))
+    finally:
+        workbook.close()
+        batches.put(None)
+
+class ConversionStream:
+    """Carries items from a conversion task to the event loop: the task puts on sink, the loop awaits get()."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, process_queue=None):
+        self._loop = loop
+        self._items: asyncio.Queue = asyncio.Queue()
+        self.sink = self if process_queue is None else process_queue
+        if process_queue is not None:
+            # A dedicated thread, so waiting on the worker never ties up the default executor
+            threading.Thread(target=self._drain, name="conversion-stream", daemon=True).start()
+
+    def put(self, item):
+        self._loop.call_soon_threadsafe(self._items.put_nowait, item)
+
+    def _drain(self):
+        while True:
+            item = self.sink.get()
+            self.put(item)
+            if item is None:
+                return
+
+    async def get(self):
+        return await self._items.get()
+
+    def close(self):
+        """Release the drain thread if the task never got to send its final None."""
+        if self.sink is not self:
+            self.sink.put(None)
+
+class ConversionExecutor:
+    """Runs blocking MarkItDown calls in a conversion pool and OpenRouter calls in an LLM thread pool."""
+
+    def __init__(self, kind: str, conversion_workers: int, llm_workers: int, queue_depth: int, timeout: float):
+        if kind == "process":
+            self._conversion_pool = ProcessPoolExecutor(
+                max_workers=conversion_workers,
+                initializer=_init_conversion_worker
+            )
+        elif kind == "thread":
+            self._conversion_pool = ThreadPoolExecutor(
+                max_workers=conversion_workers,
+                thread_name_prefix="conversion"
+            )
+        else:
+            raise ValueError(f"Unknown CONVERSION_EXECUTOR: {kind}")
+        self._llm_pool = ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="llm")
+        # Beyond its workers plus queue_depth a lane rejects with 503 rather than piling up
+        self._capacity = {
+            "conversion": conversion_workers + queue_depth,
+            "llm": llm_workers + queue_depth
+        }
+        self._pending = {"conversion": 0, "llm": 0}
+        self.timeout = timeout
+        self._kind = kind
+        self._manager = None
+
+    def _release(self, lane: str, loop: asyncio.AbstractEventLoop):
+        loop.call_soon_threadsafe(self._decrement, lane)
+
+    def _decrement(self, lane: str):
+        self._pending[lane] -= 1
+
+    async def _submit(self, lane: str, pool, fn, *args, **kwargs):
+        if self._pending[lane] >= self._capacity[lane]:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Too many pending {lane} tasks, try again later"
+            )
+        loop = asyncio.get_running_loop()
+        self._pending[lane] += 1
+        # Slots are released when the work actually finishes, so a timed-out
+        # task keeps counting against the lane until its worker is free again.
+        future = pool.submit(functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(lambda _: self._release(lane, loop))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{lane} task exceeded {self.timeout:.0f}s timeout")
+
+    async def run_conversion(self, fn, *args, **kwargs):
+        """Run a CPU-bound conversion in the conversion pool."""
+        return await self._submit("conversion", self._conversion_pool, fn, *args, **kwargs)
+
+    def open_stream(self) -> "ConversionStream":
+        """A channel a conversion task can put partial results on while it runs."""
+        if self._kind == "thread":
+            return ConversionStream(asyncio.get_running_loop())
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return ConversionStream(asyncio.get_running_loop(), self._manager.Queue())
+
+    async def run_llm(self, fn, *args, **kwargs):
+        """Run a blocking LLM call (or VLM-backed conversion) in the LLM thread pool."""
+        return await self._submit("llm", self._llm_pool, fn, *args, **kwargs)
+
+    async def convert(
+        self,
+        content: bytes,
+        llm_model: str,
+        extension: str = "",
+        mimetype: str = "",
+        is_image: bool = False
+    ) -> str:
+        """Convert file content, captioning images through the caption stage first."""
+        if is_image:
+            image_key = get_image_key(content)
+            captions, errors = await caption_stage.caption_many(
+                {image_key: (content, mimetype if '/' in mimetype else None, extension or None)},
+                llm_model
+            )
+            if image_key in errors:
+                raise errors[image_key]
+            return await self.run_llm(
+                convert_file_sync, content, llm_model, extension, mimetype, captions=captions
+            )
+        if pptx is not None and is_pptx(extension, mimetype):
+            images = await self.run_conversion(collect_pptx_images_sync, content)
+            captions, _ = await caption_stage.caption_many(images, llm_model)
+            return await self.run_conversion(
+                convert_file_sync, content, llm_model, extension, mimetype, captions=captions
+            )
+        if PDF_PARALLEL_MIN_PAGES > 0 and PDFPage is not None and is_pdf(content, extension, mimetype):
+            markdown = await convert_pdf_pages(content)
+            if markdown is not None:
+                return markdown
+        if uses_xlsx_streaming(content, extension, mimetype):
+            return await convert_xlsx_workbook(content)
+        return await self.run_conversion(convert_file_sync, content, llm_model, extension, mimetype)
+
+    def shutdown(self):
+        self._conversion_pool.shutdown(wait=False, cancel_futures=True)
+        self._llm_pool.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+
+conversion_executor = ConversionExecutor(
+    kind=CONVERSION_EXECUTOR,
+    conversion_workers=CONVERSION_POOL_SIZE,
+    llm_workers=LLM_POOL_SIZE,
+    queue_depth=EXECUTOR_QUEUE_DEPTH,
+    timeout=EXECUTOR_TASK_TIMEOUT
+)
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    conversion_executor.shutdown()
+
+class TokenBucket:
+    """Holds up to rate_per_minute units and refills at that rate."""
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken; requests larger than the bucket wait for a full one."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        """Take amount; the level may go negative when actual usage exceeds an estimate."""
+        self.level -= amount
+
+class ModelRateLimiter:
+    """Token buckets plus AIMD concurrency for one model's calls."""
+
+    def __init__(self, rpm: int, tpm: int, min_concurrency: int, max_concurrency: int, spike_factor: float):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.spike_factor = spike_factor
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.decreased_at = 0.0
+        self.latency: Optional[float] = None
+        self._waiters: List[asyncio.Future] = []
+        self.calls = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.latency_spikes = 0
+        self.decreases = 0
+        self.wait_seconds = 0.0
+
+    def _delay(self, tokens: int) -> float:
+        now = time.monotonic()
+        return max(
+            self.blocked_until - now,
+            self.requests.delay(1, now) if self.requests else 0.0,
+            self.tokens.delay(tokens, now) if self.tokens else 0.0
+        )
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def _acquire(self, tokens: int):
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = self._delay(tokens)
+            if delay <= 0 and self.in_flight < int(self.limit):
+                break
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait([waiter], timeout=delay if delay > 0 else None)
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(min(tokens, self.tokens.capacity))
+        self.in_flight += 1
+        self.wait_seconds += time.monotonic() - start
+
+    def _release(self, started: float, congested: Optional[bool]):
+        """Free a slot; congested=None (an unrelated failure) leaves limit unchanged."""
+        self.in_flight -= 1
+        # +1 per round of successes; halve at most once per round, ignoring
+        # calls that started before the last decrease
+        if congested is False:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        elif congested and started >= self.decreased_at:
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self.decreased_at = time.monotonic()
+            self.decreases += 1
+        self._wake()
+
+    async def run(self, tokens: int, call, count_tokens=None, watch_latency: bool = True):
+        await self._acquire(tokens)
+        started = time.monotonic()
+        self.calls += 1
+        try:
+            result = await call()
+        except BaseException as e:
+            congested = None
+            if isinstance(e, Exception) and is_rate_limit_error(e):
+                self.throttled += 1
+                self.blocked_until = max(self.blocked_until, time.monotonic() + get_retry_after(e))
+                congested = True
+            elif isinstance(e, (TimeoutError, APITimeoutError)):
+                self.timeouts += 1
+                congested = True
+            self._release(started, congested)
+            raise
+        congested = False
+        latency = time.monotonic() - started
+        if watch_latency:
+            if self.latency is not None and latency > self.spike_factor * self.latency:
+                self.latency_spikes += 1
+                congested = True
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.tokens and count_tokens is not None:
+            used = count_tokens(result)
+            if used:
+                self.tokens.take(used - min(tokens, self.tokens.capacity))
+        self._release(started, congested)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'concurrency_limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'waiting': len(self._waiters),
+            'calls': self.calls,
+            'throttled': self.throttled,
+            'timeouts': self.timeouts,
+            'latency_spikes': self.latency_spikes,
+            'decreases': self.decreases,
+            'wait_seconds': round(self.wait_seconds, 3),
+            'latency_seconds': round(self.latency, 3) if self.latency is not None else None
+        }
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return isinstance(error, RateLimitError) or getattr(error, 'status_code', None) == 429
+
+def get_retry_after(error: Exception) -> float:
+    """Seconds from the Retry-After header of a 429 response, 0 if absent."""
+    try:
+        return max(0.0, float(error.response.headers.get('retry-after', 0)))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+class LLMRateLimiter:
+    """Per-model rate limiters shared by every OpenRouter call made from the event loop."""
+
+    def __init__(self, rpm: int, tpm: int, min_concurrency: int, max_concurrency: int,
+                 spike_factor: float, model_limits: Dict[str, Dict[str, int]]):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.spike_factor = spike_factor
+        self.model_limits = model_limits
+        self._models: Dict[str, ModelRateLimiter] = {}
+
+    def for_model(self, model: str) -> ModelRateLimiter:
+        limiter = self._models.get(model)
+        if limiter is None:
+            limits = self.model_limits.get(model, {})
+            limiter = self._models[model] = ModelRateLimiter(
+                limits.get('rpm', self.rpm),
+                limits.get('tpm', self.tpm),
+                self.min_concurrency,
+                self.max_concurrency,
+                self.spike_factor
+            )
+        return limiter
+
+    async def run(self, model: str, tokens: int, call, count_tokens=None, watch_latency: bool = True):
+        """Await call() once the model's limiter admits it."""
+        return await self.for_model(model).run(tokens, call, count_tokens, watch_latency)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {model: limiter.stats() for model, limiter in self._models.items()}
+
+llm_limiter = LLMRateLimiter(
+    rpm=LLM_REQUESTS_PER_MINUTE,
+    tpm=LLM_TOKENS_PER_MINUTE,
+    min_concurrency=LLM_MIN_CONCURRENCY,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    spike_factor=LLM_LATENCY_SPIKE_FACTOR,
+    model_limits=LLM_MODEL_LIMITS
+)
+
+def create_async_openrouter_client() -> AsyncOpenAI:
+    """Create the pooled async OpenRouter client; retries are left to LLMClient."""
+    return AsyncOpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        default_headers={
+            "HTTP-Referer": "http://localhost:8001",  # Required for OpenRouter
+            "X-Title": "MarkItDown App",  # Optional, for OpenRouter analytics
+        },
+        max_retries=0,
+        timeout=httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
+    )
+
+def is_transient_error(error: Exception) -> bool:
+    """Connection failures, timeouts, 408/409/429 and 5xx responses are worth retrying."""
+    if isinstance(error, APIConnectionError):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status in (408, 409, 429) or (status is not None and status >= 500)
+
+class LLMClient:
+    """Async chat completions with deadlines, jittered retries and optional hedging."""
+
+    def __init__(self, client: AsyncOpenAI, deadline: float, max_retries: int, base_delay: float,
+                 max_delay: float, hedge_max_tokens: int, hedge_min_samples: int, latency_window: int):
+        self._client = client
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_max_tokens = hedge_max_tokens
+        self.hedge_min_samples = hedge_min_samples
+        self.latency_window = latency_window
+        self._latencies: Dict[str, deque] = {}
+        self.calls = 0
+        self.retries = 0
+        self.deadline_exceeded = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _record_latency(self, model: str, seconds: float):
+        self._latencies.setdefault(model, deque(maxlen=self.latency_window)).append(seconds)
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """The model's p95 latency, or None until enough calls have been seen."""
+        latencies = self._latencies.get(model)
+        if not latencies or len(latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(delay, get_retry_after(error))
+
+    async def _call(self, model: str, tokens: int, deadline: float, request,
+                    count_tokens=None, watch_latency: bool = True, can_retry=None):
+        """Run request() through llm_limiter, retrying transient failures until deadline."""
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.deadline_exceeded += 1
+                raise TimeoutError(f"LLM call to {model} exceeded its {self.deadline:g}s deadline")
+            try:
+                return await asyncio.wait_for(
+                    llm_limiter.run(
+                        model, tokens, request,
+                        count_tokens=count_tokens, watch_latency=watch_latency
+                    ),
+                    timeout=remaining
+                )
+            except asyncio.TimeoutError:
+                self.deadline_exceeded += 1
+                raise TimeoutError(f"LLM call to {model} exceeded its {self.deadline:g}s deadline")
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_transient_error(e) or (can_retry and not can_retry()):
+                    raise
+                delay = self._backoff(attempt, e)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                self.retries += 1
+                logger.warning(f"Retrying {model} call in {delay:.1f}s (attempt {attempt + 1}): {str(e)}")
+                await asyncio.sleep(delay)
+
+    async def complete(self, model: str, messages: List[Dict[str, Any]], hedge: bool = False):
+        """Return the chat completion for messages, hedging short prompts when hedge=True."""
+        self.calls += 1
+        tokens = estimate_message_tokens(messages)
+        deadline = time.monotonic() + self.deadline
+        
+        async def request():
+            started = time.monotonic()
+            response = await self._client.chat.completions.create(
+                model=model,
+                messages=messages
+            )
+            self._record_latency(model, time.monotonic() - started)
+            return response
+        
+        def attempt():
+            return self._call(
+                model, tokens, deadline, request,
+                count_tokens=lambda response: response.usage.total_tokens if response.usage else None
+            )
+        
+        delay = self.hedge_delay(model) if hedge and tokens <= self.hedge_max_tokens else None
+        if delay is None:
+            return await attempt()
+        primary = asyncio.ensure_future(attempt())
+        backup = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            self.hedged += 1
+            backup = asyncio.ensure_future(attempt())
+            pending = {primary, backup}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+            return primary.result()
+        finally:
+            primary.cancel()
+            if backup is not None:
+                backup.cancel()
+
+    async def stream(self, model: str, messages: List[Dict[str, Any]], on_delta) -> str:
+        """Stream a chat completion to on_delta, retrying only before the first chunk."""
+        self.calls += 1
+        parts: List[str] = []
+        
+        async def request() -> str:
+            stream = await self._client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    on_delta(delta)
+            return "".join(parts)
+        
+        return await self._call(
+            model, estimate_message_tokens(messages), time.monotonic() + self.deadline, request,
+            watch_latency=False, can_retry=lambda: not parts
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'deadline_exceeded': self.deadline_exceeded,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'p95_seconds': {
+                model: round(delay, 3)
+                for model in self._latencies
+                if (delay := self.hedge_delay(model)) is not None
+            }
+        }
+
+    async def close(self):
+        await self._client.close()
+
+class EventLoopChatClient:
+    """Synchronous chat client for LLM pool threads that runs each call through llm_client on the event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: List[Dict[str, Any]], **kwargs):
+        return asyncio.run_coroutine_threadsafe(llm_client.complete(model, messages), self._loop).result()
+
+llm_client = LLMClient(
+    create_async_openrouter_client(),
+    deadline=LLM_CALL_DEADLINE,
+    max_retries=LLM_MAX_RETRIES,
+    base_delay=LLM_RETRY_BASE_DELAY,
+    max_delay=LLM_RETRY_MAX_DELAY,
+    hedge_max_tokens=LLM_HEDGE_MAX_TOKENS,
+    hedge_min_samples=LLM_HEDGE_MIN_SAMPLES,
+    latency_window=LLM_LATENCY_WINDOW
+)
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.close()
+
 # Request/Response Models
 class AgentRequest(BaseModel):
     query: str
@@ -100,6 +1091,139 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
         )
     return True
 
+class FileContent:
+    """Bytes of a request file and their SHA-256, only ever attached by the server."""
+
+    def __init__(self, source, sha256: str):
+        self._source = source  # bytes, or a spooled upload until first read
+        self.sha256 = sha256
+
+    def read(self) -> bytes:
+        if not isinstance(self._source, bytes):
+            self._source.seek(0)
+            self._source = self._source.read()
+        return self._source
+
+def read_file_content(file: Dict[str, Any]) -> bytes:
+    """Return the raw bytes of a request file, from a streamed upload or its base64 field."""
+    content = file.get('content')
+    # JSON request files are client-controlled: a 'content' key there is not trusted
+    if isinstance(content, FileContent):
+        return content.read()
+    return base64.b64decode(file['base64'])
+
+class MultipartUpload:
+    """Incrementally parses a multipart/form-data body, spooling and hashing file parts as they arrive."""
+
+    max_field_bytes = 64 * 1024
+
+    def __init__(self, boundary: bytes):
+        self.fields: Dict[str, str] = {}
+        self.files: List[Dict[str, Any]] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._spools: List[Any] = []
+        self._current_file: Optional[Dict[str, Any]] = None
+        self._current_hash = None
+        self._current_spool = None
+        self._field_name = ""
+        self._field_data = bytearray()
+        self._parser = MultipartParser(boundary, callbacks={
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    def write(self, chunk: bytes):
+        self._parser.write(chunk)
+
+    def finalize(self):
+        self._parser.finalize()
+
+    def close(self):
+        for spool in self._spools:
+            spool.close()
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._current_file = None
+        self._field_name = ""
+        self._field_data = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        self._field_name = options.get(b'name', b'').decode('utf-8', 'replace')
+        if b'filename' in options:
+            spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+            self._spools.append(spool)
+            self._current_file = {
+                'name': os.path.basename(options[b'filename'].decode('utf-8', 'replace')),
+                'type': self._headers.get(b'content-type', b'').decode('latin-1'),
+                'size': 0
+            }
+            self._current_spool = spool
+            self._current_hash = hashlib.sha256()
+            self.files.append(self._current_file)
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._current_file is not None:
+            chunk = data[start:end]
+            self._current_spool.write(chunk)
+            self._current_file['size'] += len(chunk)
+            self._current_hash.update(chunk)
+        else:
+            self._field_data += data[start:end]
+            if len(self._field_data) > self.max_field_bytes:
+                raise HTTPException(status_code=413, detail=f"Form field {self._field_name} is too large")
+
+    def _on_part_end(self):
+        if self._current_file is not None:
+            self._current_file['content'] = FileContent(self._current_spool, self._current_hash.hexdigest())
+        elif self._field_name:
+            self.fields[self._field_name] = self._field_data.decode('utf-8', 'replace')
+
+async def read_multipart_upload(request: Request) -> MultipartUpload:
+    """Stream a multipart/form-data request body into a MultipartUpload, enforcing MAX_UPLOAD_BYTES."""
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data request")
+    declared_length = request.headers.get('content-length')
+    if declared_length and declared_length.isdigit() and int(declared_length) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+
+    upload = MultipartUpload(options[b'boundary'])
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+            upload.write(chunk)
+        upload.finalize()
+    except HTTPException:
+        upload.close()
+        raise
+    except Exception as e:
+        upload.close()
+        raise HTTPException(status_code=400, detail=f"Malformed multipart body: {str(e)}")
+    return upload
+
 async def fetch_conversation_history(session_id: str, limit: int = 10) -> List[Dict[str, Any]]:
     """Fetch the most recent conversation history for a session."""
     try:
@@ -136,205 +1260,1567 @@ async def store_message(session_id: str, message_type: str, content: str, data:
             "content": content,
             "data": data
         }
-        
-        # Try to insert message into Supabase
+        
+        # Try to insert message into Supabase
+        try:
+            response = supabase.table("messages").insert(message).execute()
+            if hasattr(response, 'error') and response.error is not None:
+                if "Could not find the 'content' column" in str(response.error):
+                    # Schema cache error, try to refresh schema
+                    logger.warning("Schema cache error detected, skipping message storage")
+                    return
+                raise Exception(f"Failed to store message: {response.error}")
+        except Exception as e:
+            if "Could not find the 'content' column" in str(e):
+                # Schema cache error, try to refresh schema
+                logger.warning("Schema cache error detected, skipping message storage")
+                return
+            raise e
+            
+    except Exception as e:
+        logger.error(f"Failed to store message: {e}")
+        # Don't raise the exception, just log it
+        # This prevents message storage failures from breaking the main functionality
+
+# Markdown is split before slide markers, before headings (unless the heading
+# directly follows a slide marker) and at PDF page breaks
+CHUNK_BOUNDARY = re.compile(r'(?m)^(?=<!-- Slide number: )|^(?<!-->\n)(?=#{1,6} )|\f')
+# Rough token estimate; good enough for sizing prompts without a tokenizer
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+# Flat estimate for an image in a vision-model prompt
+IMAGE_TOKENS = 1000
+
+def estimate_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Estimated prompt tokens of a chat request, for the rate limiter."""
+    total = 0
+    for message in messages:
+        content = message.get('content') or ""
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content:
+            if part.get('type') == 'text':
+                total += estimate_tokens(part.get('text', ""))
+            else:
+                total += IMAGE_TOKENS
+    return total
+
+def pack_pieces(pieces: List[str], max_tokens: int, separator: str = "") -> List[str]:
+    """Greedily join consecutive pieces into groups of at most max_tokens each."""
+    groups = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        groups.append(separator.join(current))
+    return groups
+
+def split_oversized(section: str, max_tokens: int, separators: tuple = ("\n\n", "\n")) -> List[str]:
+    """Split a section larger than max_tokens at paragraphs, then lines, then characters."""
+    if estimate_tokens(section) <= max_tokens:
+        return [section]
+    for index, separator in enumerate(separators):
+        parts = section.split(separator)
+        if len(parts) > 1:
+            pieces = [part + separator for part in parts[:-1]] + [parts[-1]]
+            return pack_pieces([
+                piece
+                for part in pieces if part
+                for piece in split_oversized(part, max_tokens, separators[index + 1:])
+            ], max_tokens)
+    width = max_tokens * CHARS_PER_TOKEN
+    return [section[start:start + width] for start in range(0, len(section), width)]
+
+def split_markdown(markdown: str, max_tokens: int = None) -> List[str]:
+    """Split markdown into chunks of at most max_tokens at headings, slide markers and page breaks."""
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    if estimate_tokens(markdown) <= max_tokens:
+        return [markdown]
+    sections = [
+        piece
+        for section in CHUNK_BOUNDARY.split(markdown) if section.strip()
+        for piece in split_oversized(section, max_tokens)
+    ]
+    return pack_pieces(sections, max_tokens)
+
+async def complete_chat(model: str, messages: List[Dict[str, str]], hedge: bool = False) -> str:
+    """Run one chat completion through llm_client and return the reply text."""
+    response = await llm_client.complete(model, messages, hedge=hedge)
+    return response.choices[0].message.content
+
+async def map_chunks(chunks: List[str], build_messages, model: str) -> List[str]:
+    """Run build_messages(chunk, k, n) over every chunk, at most CHUNK_CONCURRENCY at a time, in order."""
+    semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
+    
+    async def run_bounded(k: int, chunk: str) -> str:
+        async with semaphore:
+            return await complete_chat(model, build_messages(chunk, k, len(chunks)))
+    
+    return await asyncio.gather(*(
+        run_bounded(k, chunk) for k, chunk in enumerate(chunks, 1)
+    ))
+
+def format_partials(partials: List[str]) -> str:
+    return "\n\n".join(f"Part {k}:\n{partial}" for k, partial in enumerate(partials, 1))
+
+async def collapse_partials(partials: List[str], build_messages, model: str, max_rounds: int = 3) -> str:
+    """Combine partial results in groups until they fit in one prompt."""
+    text = format_partials(partials)
+    for _ in range(max_rounds):
+        if len(partials) <= 1 or estimate_tokens(text) <= CHUNK_MAX_TOKENS:
+            break
+        groups = pack_pieces(
+            [f"Part {k}:\n{partial}\n\n" for k, partial in enumerate(partials, 1)],
+            CHUNK_MAX_TOKENS
+        )
+        partials = await map_chunks(groups, build_messages, model)
+        text = format_partials(partials)
+    return text
+
+def build_summary_chunk_messages(chunk: str, k: int, n: int) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "You are a helpful assistant that provides concise summaries."},
+        {"role": "user", "content": f"Please provide a brief summary of the following content (part {k} of {n} of a longer document):\n\n{chunk}"}
+    ]
+
+def build_summary_reduce_messages(partials: str, k: int = 1, n: int = 1) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "You are a helpful assistant that provides concise summaries."},
+        {"role": "user", "content": f"Combine these summaries of consecutive parts of one document into a single brief summary:\n\n{partials}"}
+    ]
+
+async def generate_summary(text: str) -> str:
+    """Generate a summary using the OpenRouter API with Mistral model."""
+    try:
+        model = os.getenv("OPENROUTER_MODEL")
+        if not model:
+            raise ValueError("OPENROUTER_MODEL environment variable not set")
+        
+        chunks = split_markdown(text)
+        if len(chunks) == 1:
+            return await complete_chat(model, [
+                {"role": "system", "content": "You are a helpful assistant that provides concise summaries."},
+                {"role": "user", "content": f"Please provide a brief summary of the following content:\n\n{text}"}
+            ])
+        
+        partials = await map_chunks(chunks, build_summary_chunk_messages, model)
+        combined = await collapse_partials(partials, build_summary_reduce_messages, model)
+        return await complete_chat(model, build_summary_reduce_messages(combined))
+    except Exception as e:
+        logger.error(f"Error generating summary: {str(e)}")
+        return "Summary generation failed"
+
+async def save_markdown_file(filename: str, content: str, summary: str = None) -> str:
+    """Save markdown content to a file."""
+    try:
+        # Create directory if it doesn't exist
+        os.makedirs('markdown_results', exist_ok=True)
+        
+        # Clean filename and create full path
+        clean_filename = re.sub(r'[^\w\-_\.]', '_', filename)
+        base, ext = os.path.splitext(clean_filename)
+        markdown_path = os.path.join('markdown_results', f"{base}.md")
+        
+        # Combine summary and content
+        full_content = ""
+        if summary:
+            full_content = f"# Summary\n{summary}\n\n# Content\n{content}"
+        else:
+            full_content = content
+            
+        # Save to file
+        with open(markdown_path, 'w', encoding='utf-8') as f:
+            f.write(full_content)
+            
+        return markdown_path
+    except Exception as e:
+        logger.error(f"Error saving markdown file: {str(e)}")
+        return ""
+
+def get_conversion_model(file: Dict[str, Any], is_image: bool) -> str:
+    """Model used to convert a file: the vision model for images, otherwise the requested or default model."""
+    if is_image:
+        llm_model = os.getenv("OPENROUTER_VLM_MODEL")
+        if not llm_model:
+            raise ValueError("OPENROUTER_VLM_MODEL environment variable not set")
+    else:
+        llm_model = file.get('model') or os.getenv("OPENROUTER_MODEL")
+        if not llm_model:
+            raise ValueError("OPENROUTER_MODEL environment variable not set")
+    return llm_model
+
+async def convert_file_content(file: Dict[str, Any], content: bytes) -> str:
+    """Convert decoded file bytes to markdown, using the vision model for images."""
+    image_type = imghdr.what(io.BytesIO(content))
+    is_image = image_type is not None
+    llm_model = get_conversion_model(file, is_image)
+    if is_image:
+        logger.info(f"Detected image type: {image_type}, using vision model: {llm_model}")
+    return await conversion_executor.convert(
+        content,
+        llm_model,
+        extension=get_file_extension(file),
+        mimetype=file.get('type') or "",
+        is_image=is_image
+    )
+
+async def process_file_to_string(
+    i: int,
+    file: Dict[str, Any],
+    query: str = "",
+    markdown_content: Optional[str] = None,
+    answer_key: Optional[str] = None,
+    conversion_error: Optional[Exception] = None
+) -> str:
+    """Convert (unless already resolved or failed) and optionally query one file into its numbered context entry."""
+    decoded_content = None
+    try:
+        # Skip system files
+        if file['name'].startswith('.'):
+            logger.info(f"Skipping system file: {file['name']}")
+            return ""
+            
+        # Decode the upload; conversion works on the bytes in memory
+        decoded_content = load_file_content(file)
+        
+        # Detect if the content is an image using imghdr
+        is_image = imghdr.what(io.BytesIO(decoded_content)) is not None
+        
+        # Convert file to markdown using MarkItDown unless it came from the cache
+        if markdown_content is None:
+            if conversion_error is not None:
+                raise conversion_error
+            markdown_content = await convert_file_content(file, decoded_content)
+        
+        # If query is provided, use it with LLM
+        if query:
+            processed_content = await answer_document_query(answer_key, query, markdown_content)
+            entry = f"{i}. {file['name']}:\n\n{processed_content}\n\n"
+        else:
+            entry = f"{i}. {file['name']}:\n\n{markdown_content}\n\n"
+            
+        logger.info(f"Successfully processed {file['name']}")
+        return entry
+        
+    except HTTPException:
+        # Overload (503) is reported to the client, not papered over
+        raise
+    except Exception as e:
+        logger.error(f"Error processing file {file['name']}: {str(e)}")
+        return format_fallback_entry(i, file['name'], decoded_content)
+
+def format_fallback_entry(i: int, name: str, content: Optional[bytes]) -> str:
+    """Context entry for a file whose conversion or query failed."""
+    # Fallback to direct text conversion if markdown conversion fails
+    try:
+        if imghdr.what(io.BytesIO(content)) is not None:
+            return f"{i}. {name} (image file - processing failed)\n\n"
+        else:
+            text_content = content.decode('utf-8')
+            return f"{i}. {name} (plain text):\n\n{text_content}\n\n"
+    except:
+        return f"{i}. {name} (failed to process)\n\n"
+
+async def process_files_to_string(
+    files: Optional[List[Dict[str, Any]]],
+    query: str = "",
+    use_cache: bool = True
+) -> str:
+    """Resolve files through the document cache, query them concurrently and join their context entries in order."""
+    if not files:
+        return ""
+        
+    file_content = "File content to use as context:\n\n"
+    model = os.getenv("OPENROUTER_MODEL")
+    
+    doc_hashes: Dict[int, str] = {}
+    answers: Dict[int, str] = {}
+    documents = []
+    for i, file in enumerate(files, 1):
+        if file['name'].startswith('.'):
+            continue
+        try:
+            doc_hash = await get_document_hash(file)
+        except Exception as e:
+            # Left to process_file_to_string and its fallbacks
+            logger.error(f"Error hashing file {file['name']}: {str(e)}")
+            continue
+        doc_hashes[i] = doc_hash
+        if query and use_cache:
+            answer = answer_cache.get(get_answer_key(doc_hash, query, model))
+            if answer is not None:
+                answers[i] = answer
+                continue
+        documents.append((doc_hash, file))
+    
+    errors: Dict[str, Exception] = {}
+    resolved = await resolve_documents(documents, use_cache=use_cache, errors=errors) if documents else {}
+    semaphore = asyncio.Semaphore(FILE_CONCURRENCY)
+    
+    async def process_bounded(i: int, file: Dict[str, Any]) -> str:
+        if i in answers:
+            return f"{i}. {file['name']}:\n\n{answers[i]}\n\n"
+        doc_hash = doc_hashes.get(i)
+        answer_key = get_answer_key(doc_hash, query, model) if query and doc_hash and use_cache else None
+        async with semaphore:
+            return await process_file_to_string(
+                i, file, query,
+                markdown_content=resolved.get(doc_hash),
+                answer_key=answer_key,
+                conversion_error=errors.get(doc_hash)
+            )
+    
+    entries = await asyncio.gather(*(
+        process_bounded(i, file) for i, file in enumerate(files, 1)
+    ))
+    file_content += "".join(entries)
+    
+    return file_content
+
+def load_file_content(file_data: Dict[str, Any]) -> bytes:
+    """Decode a request file once, keeping its bytes and their SHA-256 on the file dict as a FileContent."""
+    content = file_data.get('content')
+    if not isinstance(content, FileContent):
+        # Always hash the decoded bytes; any 'sha256' or 'content' sent by the client is ignored
+        data = base64.b64decode(file_data['base64'])
+        content = FileContent(data, hashlib.sha256(data).hexdigest())
+        file_data['content'] = content
+    return content.read()
+
+def get_options_fingerprint(
+    model: str,
+    extension: str = "",
+    mimetype: str = "",
+    use_llm: bool = True,
+    converter: str = CONVERTER_VERSION
+) -> str:
+    """Fingerprint of the conversion options that shape the cached markdown."""
+    options = f"{model}|{extension}|{mimetype}|{use_llm}|{converter}|{CACHE_FORMAT_VERSION}"
+    return hashlib.sha256(options.encode('utf-8')).hexdigest()[:16]
+
+async def get_document_hash(file_data: Dict[str, Any]) -> str:
+    """Cache key for a document: content hash plus a fingerprint of the options that shape its conversion."""
+    content = load_file_content(file_data)
+    is_image = imghdr.what(io.BytesIO(content)) is not None
+    model = get_conversion_model(file_data, is_image)
+    file_type = file_data.get('type') or ""
+    extension = get_file_extension(file_data)
+    mimetype = file_type if '/' in file_type else ""
+    # Extension and mimetype pick MarkItDown's converter; the rest of the name does not matter
+    fingerprint = get_options_fingerprint(
+        model,
+        extension=extension,
+        mimetype=mimetype,
+        converter=XLSX_STREAMING_CONVERTER if uses_xlsx_streaming(content, extension, mimetype) else CONVERTER_VERSION
+    )
+    return f"{file_data['content'].sha256}:{fingerprint}"
+
+def compress_markdown(markdown: str, codec: str = None) -> tuple:
+    """Compress markdown with CACHE_COMPRESSION, returning (payload bytes, codec)."""
+    codec = codec or CACHE_COMPRESSION
+    raw = markdown.encode('utf-8')
+    if codec in ("none", "identity") or len(raw) < CACHE_COMPRESSION_MIN_BYTES:
+        return raw, "identity"
+    if codec == "zstd":
+        compressed = zstandard.ZstdCompressor(level=3).compress(raw)
+    else:
+        codec = "zlib"
+        compressed = zlib.compress(raw, 6)
+    # Incompressible text, like small documents, is kept raw
+    if len(compressed) >= len(raw):
+        return raw, "identity"
+    return compressed, codec
+
+def decompress_markdown(payload: bytes, codec: Optional[str]) -> str:
+    """Reverse compress_markdown."""
+    if not codec or codec == "identity":
+        return payload.decode('utf-8')
+    if codec == "zlib":
+        return zlib.decompress(payload).decode('utf-8')
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd-compressed cache entry but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload).decode('utf-8')
+    raise ValueError(f"Unknown cache codec: {codec}")
+
+def encode_markdown(markdown: str, codec: str = None) -> tuple:
+    """Encode markdown for the document_cache text column, returning (stored, codec)."""
+    payload, codec = compress_markdown(markdown, codec)
+    if codec == "identity":
+        return markdown, codec
+    stored = base64.b64encode(payload).decode('ascii')
+    if len(stored) >= len(markdown.encode('utf-8')):
+        return markdown, "identity"
+    return stored, codec
+
+def decode_markdown(stored: str, codec: Optional[str]) -> str:
+    """Decode a document_cache markdown_content value written by encode_markdown."""
+    if not codec or codec == "identity":
+        return stored
+    return decompress_markdown(base64.b64decode(stored), codec)
+
+class CacheBackend:
+    """Persistent store for converted markdown keyed by document hash (selected with CACHE_BACKEND)."""
+
+    name = "base"
+
+    async def get_many(self, doc_hashes: List[str]) -> Dict[str, str]:
+        """Return markdown for the hashes that are cached."""
+        raise NotImplementedError
+
+    async def put_many(self, documents: List[tuple]):
+        """Store (doc_hash, markdown, file_data) triples."""
+        raise NotImplementedError
+
+    async def touch_many(self, doc_hashes: List[str], accessed_at: datetime):
+        """Set last_accessed for the given hashes."""
+        raise NotImplementedError
+
+    async def evict(self, max_bytes: Optional[int], ttl_seconds: Optional[int]) -> Dict[str, int]:
+        """Drop entries idle past ttl_seconds, then least recently accessed ones until under max_bytes."""
+        raise NotImplementedError
+
+class SupabaseCacheBackend(CacheBackend):
+    """The document_cache table in Supabase (see supabase/migrations)."""
+
+    name = "supabase"
+    batch_size = 100  # Hashes per in_ filter, keeps the request URL short
+
+    def __init__(self, supabase_client):
+        self._client = supabase_client
+
+    def _get_many(self, doc_hashes: List[str]) -> Dict[str, str]:
+        """Retrieve cached markdown for many documents from Supabase, one query per batch"""
+        found = {}
+        for start in range(0, len(doc_hashes), self.batch_size):
+            result = self._client.table('document_cache')\
+                .select('doc_hash, markdown_content, codec')\
+                .in_('doc_hash', doc_hashes[start:start + self.batch_size])\
+                .execute()
+
+            for row in result.data or []:
+                try:
+                    found[row['doc_hash']] = decode_markdown(row['markdown_content'], row.get('codec'))
+                except Exception as e:
+                    # Treat undecodable entries as misses; they get reconverted and overwritten
+                    logger.error(f"Failed to decode cached document {row['doc_hash']}: {str(e)}")
+        return found
+
+    def _put_many(self, documents: List[tuple]):
+        """Store documents in Supabase with one bulk upsert"""
+        now = datetime.utcnow().isoformat()
+        rows = []
+        for doc_hash, markdown, file_data in documents:
+            stored, codec = encode_markdown(markdown)
+            rows.append({
+                'doc_hash': doc_hash,
+                'file_name': file_data.get('name') or '',
+                'file_type': file_data.get('type') or '',
+                'markdown_content': stored,
+                'codec': codec,
+                'created_at': now,
+                'last_accessed': now
+            })
+
+        self._client.table('document_cache').upsert(rows, on_conflict='doc_hash').execute()
+
+    async def get_many(self, doc_hashes: List[str]) -> Dict[str, str]:
+        return await asyncio.to_thread(self._get_many, doc_hashes)
+
+    async def put_many(self, documents: List[tuple]):
+        await asyncio.to_thread(self._put_many, documents)
+
+    async def touch_many(self, doc_hashes: List[str], accessed_at: datetime):
+        for start in range(0, len(doc_hashes), self.batch_size):
+            batch = doc_hashes[start:start + self.batch_size]
+            await asyncio.to_thread(
+                lambda: self._client.table('document_cache')
+                    .update({'last_accessed': accessed_at.isoformat()})
+                    .in_('doc_hash', batch)
+                    .execute()
+            )
+
+    async def evict(self, max_bytes: Optional[int], ttl_seconds: Optional[int]) -> Dict[str, int]:
+        # evict_document_cache is defined in 20250210_document_cache_eviction.sql
+        params = {'max_total_bytes': max_bytes, 'max_age_seconds': ttl_seconds}
+        response = await asyncio.to_thread(
+            lambda: self._client.rpc('evict_document_cache', params).execute()
+        )
+        return dict(response.data[0]) if response.data else {}
+
+class SQLiteCacheBackend(CacheBackend):
+    """A local SQLite database in WAL mode, for single-node deployments and offline runs."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        self._db.execute("""
+            create table if not exists document_cache (
+                doc_hash text primary key,
+                file_name text,
+                file_type text,
+                markdown_content blob not null,
+                codec text not null,
+                content_bytes integer not null,
+                created_at text not null,
+                last_accessed text not null
+            )
+        """)
+        self._db.execute(
+            "create index if not exists idx_document_cache_last_accessed on document_cache(last_accessed)"
+        )
+
+    def _execute(self, sql: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _get_many(self, doc_hashes: List[str]) -> Dict[str, str]:
+        found = {}
+        placeholders = ",".join("?" * len(doc_hashes))
+        rows = self._execute(
+            f"select doc_hash, markdown_content, codec from document_cache where doc_hash in ({placeholders})",
+            doc_hashes
+        )
+        for doc_hash, payload, codec in rows:
+            try:
+                found[doc_hash] = decompress_markdown(payload, codec)
+            except Exception as e:
+                logger.error(f"Failed to decode cached document {doc_hash}: {str(e)}")
+        return found
+
+    def _put_many(self, documents: List[tuple]):
+        now = datetime.utcnow().isoformat()
+        rows = []
+        for doc_hash, markdown, file_data in documents:
+            payload, codec = compress_markdown(markdown)
+            rows.append((
+                doc_hash, file_data.get('name') or '', file_data.get('type') or '',
+                payload, codec, len(payload), now, now
+            ))
+        with self._lock:
+            self._db.executemany(
+                "insert or replace into document_cache values (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def _touch_many(self, doc_hashes: List[str], accessed_at: datetime):
+        with self._lock:
+            self._db.executemany(
+                "update document_cache set last_accessed = ? where doc_hash = ?",
+                [(accessed_at.isoformat(), doc_hash) for doc_hash in doc_hashes]
+            )
+
+    def _evict(self, max_bytes: Optional[int], ttl_seconds: Optional[int]) -> Dict[str, int]:
+        result = {'expired_rows': 0, 'expired_bytes': 0, 'evicted_rows': 0, 'evicted_bytes': 0}
+        with self._lock:
+            if ttl_seconds:
+                cutoff = (datetime.utcnow() - timedelta(seconds=ttl_seconds)).isoformat()
+                rows, size = self._db.execute(
+                    "select count(*), coalesce(sum(content_bytes), 0) from document_cache where last_accessed < ?",
+                    (cutoff,)
+                ).fetchone()
+                self._db.execute("delete from document_cache where last_accessed < ?", (cutoff,))
+                result.update(expired_rows=rows, expired_bytes=size)
+            if max_bytes:
+                over_budget = """
+                    select doc_hash, content_bytes from (
+                        select doc_hash, content_bytes,
+                               sum(content_bytes) over (order by last_accessed desc, doc_hash desc) as running_bytes
+                        from document_cache
+                    ) where running_bytes > ?
+                """
+                victims = self._db.execute(over_budget, (max_bytes,)).fetchall()
+                self._db.executemany(
+                    "delete from document_cache where doc_hash = ?",
+                    [(doc_hash,) for doc_hash, _ in victims]
+                )
+                result.update(evicted_rows=len(victims), evicted_bytes=sum(size for _, size in victims))
+            rows, size = self._db.execute(
+                "select count(*), coalesce(sum(content_bytes), 0) from document_cache"
+            ).fetchone()
+        result.update(remaining_rows=rows, remaining_bytes=size)
+        return result
+
+    async def get_many(self, doc_hashes: List[str]) -> Dict[str, str]:
+        return await asyncio.to_thread(self._get_many, doc_hashes)
+
+    async def put_many(self, documents: List[tuple]):
+        await asyncio.to_thread(self._put_many, documents)
+
+    async def touch_many(self, doc_hashes: List[str], accessed_at: datetime):
+        await asyncio.to_thread(self._touch_many, doc_hashes, accessed_at)
+
+    async def evict(self, max_bytes: Optional[int], ttl_seconds: Optional[int]) -> Dict[str, int]:
+        return await asyncio.to_thread(self._evict, max_bytes, ttl_seconds)
+
+class DiskCacheBackend(CacheBackend):
+    """Content-addressed files under a directory, one file per document hash."""
+
+    name = "disk"
+    extensions = {"identity": ".md", "zlib": ".zlib", "zstd": ".zst"}
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _stem(self, doc_hash: str) -> str:
+        # <root>/<first two hash chars>/<doc hash>.<codec>; mtime is last_accessed
+        safe_hash = re.sub(r'[^\w\-]', '-', doc_hash)
+        return os.path.join(self.root, safe_hash[:2], safe_hash)
+
+    def _find(self, doc_hash: str) -> Optional[tuple]:
+        stem = self._stem(doc_hash)
+        for codec, extension in self.extensions.items():
+            if os.path.exists(stem + extension):
+                return stem + extension, codec
+        return None
+
+    def _get_many(self, doc_hashes: List[str]) -> Dict[str, str]:
+        found = {}
+        for doc_hash in doc_hashes:
+            location = self._find(doc_hash)
+            if location is None:
+                continue
+            path, codec = location
+            try:
+                with open(path, 'rb') as f:
+                    found[doc_hash] = decompress_markdown(f.read(), codec)
+            except FileNotFoundError:
+                continue  # Evicted between the lookup and the read
+            except Exception as e:
+                logger.error(f"Failed to decode cached document {doc_hash}: {str(e)}")
+        return found
+
+    def _put_many(self, documents: List[tuple]):
+        for doc_hash, markdown, _ in documents:
+            payload, codec = compress_markdown(markdown)
+            stem = self._stem(doc_hash)
+            os.makedirs(os.path.dirname(stem), exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(stem), delete=False) as temp_file:
+                temp_file.write(payload)
+            os.replace(temp_file.name, stem + self.extensions[codec])
+            # Drop copies stored under another codec
+            for other_codec, extension in self.extensions.items():
+                if other_codec != codec and os.path.exists(stem + extension):
+                    os.remove(stem + extension)
+
+    def _touch_many(self, doc_hashes: List[str], accessed_at: datetime):
+        timestamp = accessed_at.replace(tzinfo=timezone.utc).timestamp()
+        for doc_hash in doc_hashes:
+            location = self._find(doc_hash)
+            if location is not None:
+                try:
+                    os.utime(location[0], (timestamp, timestamp))
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self, max_bytes: Optional[int], ttl_seconds: Optional[int]) -> Dict[str, int]:
+        entries = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse=True)  # Most recently accessed first
+
+        result = {'expired_rows': 0, 'expired_bytes': 0, 'evicted_rows': 0, 'evicted_bytes': 0}
+        cutoff = time.time() - ttl_seconds if ttl_seconds else None
+        kept_bytes = 0
+        kept_rows = 0
+        for mtime, size, path in entries:
+            if cutoff is not None and mtime < cutoff:
+                kind = 'expired'
+            elif max_bytes and kept_bytes + size > max_bytes:
+                kind = 'evicted'
+            else:
+                kept_bytes += size
+                kept_rows += 1
+                continue
+            try:
+                os.remove(path)
+                result[f'{kind}_rows'] += 1
+                result[f'{kind}_bytes'] += size
+            except FileNotFoundError:
+                pass
+        result.update(remaining_rows=kept_rows, remaining_bytes=kept_bytes)
+        return result
+
+    async def get_many(self, doc_hashes: List[str]) -> Dict[str, str]:
+        return await asyncio.to_thread(self._get_many, doc_hashes)
+
+    async def put_many(self, documents: List[tuple]):
+        await asyncio.to_thread(self._put_many, documents)
+
+    async def touch_many(self, doc_hashes: List[str], accessed_at: datetime):
+        await asyncio.to_thread(self._touch_many, doc_hashes, accessed_at)
+
+    async def evict(self, max_bytes: Optional[int], ttl_seconds: Optional[int]) -> Dict[str, int]:
+        return await asyncio.to_thread(self._evict, max_bytes, ttl_seconds)
+
+def create_cache_backend(kind: str) -> CacheBackend:
+    """Build the CacheBackend selected by CACHE_BACKEND."""
+    if kind == "supabase":
+        return SupabaseCacheBackend(supabase)
+    if kind == "sqlite":
+        return SQLiteCacheBackend(CACHE_SQLITE_PATH)
+    if kind == "disk":
+        return DiskCacheBackend(CACHE_DIR)
+    raise ValueError(f"Unknown CACHE_BACKEND: {kind}")
+
+document_cache = create_cache_backend(CACHE_BACKEND)
+
+async def store_document_markdown(
+    cache: CacheBackend,
+    doc_hash: str,
+    markdown: str,
+    file_data: Dict[str, Any]
+):
+    """Store document markdown in the cache backend"""
+    await cache.put_many([(doc_hash, markdown, file_data)])
+
+async def get_cached_markdown(
+    cache: CacheBackend,
+    doc_hash: str
+) -> Optional[str]:
+    """Retrieve cached markdown from the cache backend"""
+    found = await cache.get_many([doc_hash])
+    if found:
+        # last_accessed is written later in batches, off the read path
+        access_tracker.touch(found)
+    return found.get(doc_hash)
+
+class AccessTracker:
+    """Buffers document_cache last_accessed updates and writes them in batches."""
+
+    def __init__(self, cache: CacheBackend, flush_interval: float, max_pending: int):
+        self._cache = cache
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = set()
+        self._loop_task: Optional[asyncio.Task] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.touched = 0
+        self.failures = 0
+
+    def touch(self, doc_hashes):
+        # Hits never wait on a write: recency is flushed every flush_interval or once max_pending hashes wait
+        self._pending.update(doc_hashes)
+        if len(self._pending) >= self.max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if not self._pending:
+            return
+        doc_hashes = list(self._pending)
+        self._pending.clear()
+        try:
+            await self._cache.touch_many(doc_hashes, datetime.utcnow())
+            self.flushes += 1
+            self.touched += len(doc_hashes)
+        except Exception as e:
+            # Keep the hashes so the next flush retries them
+            logger.error(f"Failed to update last_accessed for {len(doc_hashes)} documents: {str(e)}")
+            self.failures += 1
+            self._pending.update(doc_hashes)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'pending': len(self._pending),
+            'flushes': self.flushes,
+            'touched': self.touched,
+            'failures': self.failures
+        }
+
+access_tracker = AccessTracker(document_cache, TOUCH_FLUSH_INTERVAL, TOUCH_BUFFER_SIZE)
+
+@app.on_event("startup")
+async def start_access_tracker():
+    access_tracker.start()
+
+@app.on_event("shutdown")
+async def stop_access_tracker():
+    await access_tracker.stop()
+
+class CacheEvictor:
+    """Keeps the cache backend within CACHE_TTL_SECONDS and CACHE_MAX_BYTES."""
+
+    def __init__(self, cache: CacheBackend, max_bytes: int, ttl_seconds: int, interval: float):
+        self._cache = cache
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.interval = interval
+        self._loop_task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.rows_reclaimed = 0
+        self.bytes_reclaimed = 0
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    async def run_once(self) -> Dict[str, Any]:
+        # Flush buffered recency first so recently used entries survive
+        await access_tracker.flush()
+        result = await self._cache.evict(self.max_bytes or None, self.ttl_seconds or None)
+        result['ran_at'] = datetime.utcnow().isoformat()
+        self.runs += 1
+        self.rows_reclaimed += result.get('expired_rows', 0) + result.get('evicted_rows', 0)
+        self.bytes_reclaimed += result.get('expired_bytes', 0) + result.get('evicted_bytes', 0)
+        self.last_result = result
+        logger.info(f"Document cache eviction: {result}")
+        return result
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Document cache eviction failed: {str(e)}")
+
+    def start(self):
+        if self.interval > 0 and self._loop_task is None:
+            self._loop_task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'runs': self.runs,
+            'rows_reclaimed': self.rows_reclaimed,
+            'bytes_reclaimed': self.bytes_reclaimed,
+            'last_result': self.last_result
+        }
+
+cache_evictor = CacheEvictor(document_cache, CACHE_MAX_BYTES, CACHE_TTL_SECONDS, CACHE_EVICTION_INTERVAL)
+
+@app.on_event("startup")
+async def start_cache_evictor():
+    cache_evictor.start()
+
+@app.on_event("shutdown")
+async def stop_cache_evictor():
+    cache_evictor.stop()
+
+class DocumentLRUCache:
+    """In-process LRU of converted markdown, bounded by entry count and total UTF-8 size."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, markdown: str):
+        size = len(markdown.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        self._entries[key] = (markdown, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            evicted_key, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+            self._evicted(evicted_key)
+
+    def _evicted(self, key: str):
+        """Hook for subclasses keeping per-entry state."""
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+document_memory_cache = DocumentLRUCache(MEMORY_CACHE_MAX_ENTRIES, MEMORY_CACHE_MAX_BYTES)
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one shared task."""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.joined = 0
+
+    def start(self, key: str, work) -> tuple:
+        """Return (task, started): the running task for key, starting work() if there is none."""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.joined += 1
+            return task, False
+        task = asyncio.ensure_future(work())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        self.started += 1
+        return task, True
+
+    async def run(self, key: str, work):
+        task, _ = self.start(key, work)
+        # A disconnecting caller must not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': len(self._inflight),
+            'started': self.started,
+            'joined': self.joined
+        }
+
+conversion_flights = SingleFlight()
+
+class CaptionStage:
+    """Captions images with the vision model, bounded, deduplicated and cached."""
+
+    def __init__(self, cache: CacheBackend, concurrency: int):
+        self._cache = cache
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._flights = SingleFlight()
+        self.requested = 0
+        self.cache_hits = 0
+        self.captioned = 0
+        self.failed = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    @staticmethod
+    def fingerprint(model: str, prompt: Optional[str]) -> str:
+        options = (
+            f"caption|{model}|{prompt or ''}|{CONVERTER_VERSION}|{CACHE_FORMAT_VERSION}"
+            f"|{VLM_IMAGE_MAX_DIMENSION}|{VLM_IMAGE_FORMAT}|{VLM_IMAGE_QUALITY}"
+        )
+        return hashlib.sha256(options.encode('utf-8')).hexdigest()[:16]
+
+    async def caption_many(self, images: Dict[str, tuple], model: str, prompt: Optional[str] = None) -> tuple:
+        """Caption {image key: (blob, mimetype, extension)}, returning (captions, errors)."""
+        captions: Dict[str, Optional[str]] = {}
+        errors: Dict[str, Exception] = {}
+        if not images:
+            return captions, errors
+        self.requested += len(images)
+        fingerprint = self.fingerprint(model, prompt)
+        cache_keys = {image_key: f"{image_key}:{fingerprint}" for image_key in images}
+        
+        try:
+            found = await self._cache.get_many(list(cache_keys.values()))
+            access_tracker.touch(found)
+        except Exception as e:
+            logger.error(f"Caption cache lookup failed: {str(e)}")
+            found = {}
+        for image_key, cache_key in cache_keys.items():
+            if cache_key in found:
+                captions[image_key] = found[cache_key]
+        self.cache_hits += len(captions)
+        
+        missing = [image_key for image_key in images if image_key not in captions]
+        outcomes = await asyncio.gather(*(
+            self._flights.run(
+                cache_keys[image_key],
+                functools.partial(self._caption, images[image_key], model, prompt)
+            )
+            for image_key in missing
+        ), return_exceptions=True)
+        
+        to_store = []
+        for image_key, outcome in zip(missing, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Failed to caption image {image_key[:12]}: {str(outcome)}")
+                captions[image_key] = None
+                errors[image_key] = outcome
+                self.failed += 1
+            else:
+                captions[image_key] = outcome
+                if outcome is not None:
+                    to_store.append((cache_keys[image_key], outcome, {'name': 'image caption', 'type': 'text/plain'}))
+        if to_store:
+            try:
+                await self._cache.put_many(to_store)
+            except Exception as e:
+                logger.error(f"Failed to store {len(to_store)} captions in cache: {str(e)}")
+        if missing:
+            logger.info(f"Captioned {len(missing)} of {len(images)} images ({len(images) - len(missing)} cached)")
+        return captions, errors
+
+    async def _caption(self, image: tuple, model: str, prompt: Optional[str]) -> Optional[str]:
+        blob, mimetype, extension = image
+        self.bytes_received += len(blob)
+        if Image is not None and VLM_IMAGE_MAX_DIMENSION > 0:
+            blob, mimetype, extension = await conversion_executor.run_conversion(
+                prepare_vlm_image_sync,
+                blob, mimetype, extension,
+                VLM_IMAGE_MAX_DIMENSION, VLM_IMAGE_FORMAT, VLM_IMAGE_QUALITY
+            )
+        self.bytes_sent += len(blob)
+        async with self._semaphore:
+            caption = await conversion_executor.run_llm(
+                llm_caption,
+                io.BytesIO(blob),
+                StreamInfo(mimetype=mimetype, extension=extension),
+                client=EventLoopChatClient(asyncio.get_running_loop()),
+                model=model,
+                prompt=prompt
+            )
+        self.captioned += 1
+        return caption
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'requested': self.requested,
+            'cache_hits': self.cache_hits,
+            'captioned': self.captioned,
+            'failed': self.failed,
+            'bytes_received': self.bytes_received,
+            'bytes_sent': self.bytes_sent,
+            'in_flight': self._flights.stats()['in_flight']
+        }
+
+caption_stage = CaptionStage(document_cache, CAPTION_CONCURRENCY)
+
+# Set by the streaming endpoint to receive parts of a document as they finish
+conversion_progress: contextvars.ContextVar = contextvars.ContextVar('conversion_progress', default=None)
+
+def report_conversion_part(part: int, parts: Optional[int], markdown: str):
+    """Pass a finished part of the document being converted to the streaming client, if any."""
+    callback = conversion_progress.get()
+    if callback is not None:
+        callback(part, parts, markdown)
+
+async def convert_xlsx_workbook(content: bytes) -> str:
+    """Convert a large workbook in one streaming task, reporting each row batch to a streaming client as it arrives."""
+    stream = conversion_executor.open_stream()
+    task = asyncio.ensure_future(
+        conversion_executor.run_conversion(convert_xlsx_sync, content, XLSX_ROW_BATCH, stream.sink)
+    )
+    parts = []
+    try:
+        while True:
+            batch = asyncio.ensure_future(stream.get())
+            await asyncio.wait({batch, task}, return_when=asyncio.FIRST_COMPLETED)
+            if not batch.done() and task.exception() is not None:
+                batch.cancel()  # Rejected, timed out or failed before its final batch
+                break
+            if await batch is None:
+                break
+            parts.append(batch.result())
+            report_conversion_part(len(parts), None, batch.result())
+    finally:
+        stream.close()
+    await task
+    logger.info(f"Converted workbook: {len(parts)} row batches")
+    return "".join(parts).strip()
+
+PDF_PAGE_FINGERPRINT = hashlib.sha256(
+    f"pdfminer-{pdfminer.__version__ if PDFPage is not None else ''}"
+    f"|pdfplumber-{pdfplumber.__version__ if PDFPage is not None else ''}"
+    f"|{CONVERTER_VERSION}|{CACHE_FORMAT_VERSION}".encode('utf-8')
+).hexdigest()[:16]
+
+async def extract_pdf_pages_cached(content: bytes, page_hashes: List[str], kind: str, extract) -> List[str]:
+    """Per-page results of extract(content, page_numbers), cached under each page's hash and kind."""
+    keys = [f"{page_hash}:{PDF_PAGE_FINGERPRINT}:{kind}" for page_hash in page_hashes]
+    try:
+        cached = await document_cache.get_many(list(set(keys)))
+        access_tracker.touch(cached)
+    except Exception as e:
+        logger.error(f"PDF page cache lookup failed: {str(e)}")
+        cached = {}
+    
+    missing = [number for number, key in enumerate(keys) if key not in cached]
+    ranges = [missing[start:start + PDF_PAGES_PER_TASK] for start in range(0, len(missing), PDF_PAGES_PER_TASK)]
+    extracted = await asyncio.gather(*(
+        conversion_executor.run_conversion(extract, content, page_range)
+        for page_range in ranges
+    ))
+    
+    pages = dict(cached)
+    to_store = {}
+    for page_range, results in zip(ranges, extracted):
+        for number, result in zip(page_range, results):
+            pages[keys[number]] = result
+            to_store[keys[number]] = (keys[number], result, {'name': f"page {number + 1}", 'type': 'application/pdf'})
+    if to_store:
         try:
-            response = supabase.table("messages").insert(message).execute()
-            if hasattr(response, 'error') and response.error is not None:
-                if "Could not find the 'content' column" in str(response.error):
-                    # Schema cache error, try to refresh schema
-                    logger.warning("Schema cache error detected, skipping message storage")
-                    return
-                raise Exception(f"Failed to store message: {response.error}")
+            await document_cache.put_many(list(to_store.values()))
         except Exception as e:
-            if "Could not find the 'content' column" in str(e):
-                # Schema cache error, try to refresh schema
-                logger.warning("Schema cache error detected, skipping message storage")
-                return
-            raise e
-            
-    except Exception as e:
-        logger.error(f"Failed to store message: {e}")
-        # Don't raise the exception, just log it
-        # This prevents message storage failures from breaking the main functionality
+            logger.error(f"Failed to store {len(to_store)} PDF pages in cache: {str(e)}")
+    logger.info(f"PDF {kind} pass: {len(keys)} pages, {len(missing)} extracted in {len(ranges)} ranges")
+    return [pages[key] for key in keys]
 
-async def generate_summary(text: str) -> str:
-    """Generate a summary using the OpenRouter API with Mistral model."""
+async def convert_pdf_pages(content: bytes) -> Optional[str]:
+    """Convert a long PDF the way MarkItDown does, page range by page range in parallel with per-page caching."""
     try:
-        model = os.getenv("OPENROUTER_MODEL")
-        if not model:
-            raise ValueError("OPENROUTER_MODEL environment variable not set")
-            
-        response = openai_client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that provides concise summaries."},
-                {"role": "user", "content": f"Please provide a brief summary of the following content:\n\n{text}"}
-            ]
-        )
-        return response.choices[0].message.content
+        # Short PDFs are the common case; don't parse their pages just to hand them to MarkItDown
+        if await conversion_executor.run_conversion(count_pdf_pages_sync, content) < PDF_PARALLEL_MIN_PAGES:
+            return None
+        page_hashes = await conversion_executor.run_conversion(hash_pdf_pages_sync, content)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error generating summary: {str(e)}")
-        return "Summary generation failed"
-
-async def save_markdown_file(filename: str, content: str, summary: str = None) -> str:
-    """Save markdown content to a file."""
+        logger.warning(f"Could not split PDF into pages, converting it whole: {str(e)}")
+        return None
+    if len(page_hashes) < PDF_PARALLEL_MIN_PAGES:
+        return None
+    
+    # Same decision as MarkItDown's PdfConverter: pdfplumber finds form and
+    # table pages; if there are none, the document is pdfminer prose
+    markdown = ""
     try:
-        # Create directory if it doesn't exist
-        os.makedirs('markdown_results', exist_ok=True)
-        
-        # Clean filename and create full path
-        clean_filename = re.sub(r'[^\w\-_\.]', '_', filename)
-        base, ext = os.path.splitext(clean_filename)
-        markdown_path = os.path.join('markdown_results', f"{base}.md")
-        
-        # Combine summary and content
-        full_content = ""
-        if summary:
-            full_content = f"# Summary\n{summary}\n\n# Content\n{content}"
-        else:
-            full_content = content
-            
-        # Save to file
-        with open(markdown_path, 'w', encoding='utf-8') as f:
-            f.write(full_content)
-            
-        return markdown_path
+        layout = [json.loads(page) for page in
+                  await extract_pdf_pages_cached(content, page_hashes, "layout", extract_pdf_layout_sync)]
+        if any(page['form'] for page in layout):
+            markdown = "\n\n".join(
+                page['text'] if page['form'] else page['text'].strip()
+                for page in layout if page['text'].strip()
+            ).strip()
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error saving markdown file: {str(e)}")
-        return ""
+        logger.warning(f"pdfplumber pass failed, using pdfminer text: {str(e)}")
+    if not markdown:
+        markdown = "".join(await extract_pdf_pages_cached(content, page_hashes, "text", extract_pdf_pages_sync))
+    # Whitespace normalization MarkItDown.convert applies to every converter's output
+    markdown = "\n".join(line.rstrip() for line in re.split(r"\r?\n", _merge_partial_numbering_lines(markdown)))
+    return re.sub(r"\n{3,}", "\n\n", markdown)
 
-async def process_files_to_string(files: Optional[List[Dict[str, Any]]], query: str = "") -> str:
-    """Convert a list of files with base64 content into a formatted string using MarkItDown."""
-    if not files:
-        return ""
-        
-    file_content = "File content to use as context:\n\n"
-    
-    for i, file in enumerate(files, 1):
-        try:
-            # Skip system files
-            if file['name'].startswith('.'):
-                logger.info(f"Skipping system file: {file['name']}")
+class AnswerCache(DocumentLRUCache):
+    """DocumentLRUCache of per-query LLM answers whose entries expire after ttl seconds."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        super().__init__(max_entries, max_bytes)
+        self.ttl = ttl
+        self._stored_at: Dict[str, float] = {}
+        self.expired = 0
+
+    def get(self, key: str) -> Optional[str]:
+        stored_at = self._stored_at.get(key)
+        if stored_at is not None and self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+            _, size = self._entries.pop(key)
+            self._bytes -= size
+            del self._stored_at[key]
+            self.expired += 1
+        return super().get(key)
+
+    def put(self, key: str, answer: str):
+        if self.max_entries <= 0:
+            return
+        super().put(key, answer)
+        if key in self._entries:
+            self._stored_at[key] = time.monotonic()
+
+    def _evicted(self, key: str):
+        self._stored_at.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {**super().stats(), 'ttl_seconds': self.ttl, 'expired': self.expired}
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_MAX_BYTES, ANSWER_CACHE_TTL_SECONDS)
+answer_flights = SingleFlight()
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for answer caching: case-folded with whitespace collapsed."""
+    return " ".join(query.split()).casefold()
+
+def get_answer_key(doc_hash: str, query: str, model: str) -> str:
+    """Cache key for an answer: document hash, normalized query and answering model."""
+    key = f"{doc_hash}|{normalize_query(query)}|{model}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def build_query_messages(query: str, markdown_content: str) -> List[Dict[str, str]]:
+    """Chat messages asking the model to process a document's markdown according to the query."""
+    return [
+        {"role": "system", "content": "You are a helpful assistant that processes text based on user queries."},
+        {"role": "user", "content": f"{query}\n\nText to process:\n{markdown_content}"}
+    ]
+
+def build_query_chunk_messages(query: str):
+    """Message builder for map_chunks: run the query over one part of a longer document."""
+    def build(chunk: str, k: int, n: int) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": "You are a helpful assistant that processes text based on user queries."},
+            {"role": "user", "content": (
+                f"{query}\n\nThe text below is part {k} of {n} of a longer document. "
+                f"Answer from this part only; if it contains nothing relevant, say so briefly."
+                f"\n\nText to process:\n{chunk}"
+            )}
+        ]
+    return build
+
+def build_query_reduce_messages(query: str):
+    """Message builder combining per-part answers to the query into one answer."""
+    def build(partials: str, k: int = 1, n: int = 1) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": "You are a helpful assistant that processes text based on user queries."},
+            {"role": "user", "content": (
+                f"{query}\n\nThe answers below were produced from consecutive parts of one document. "
+                f"Combine them into a single answer, ignoring parts with nothing relevant."
+                f"\n\n{partials}"
+            )}
+        ]
+    return build
+
+TERM_PATTERN = re.compile(r'\w+')
+# Function words that would otherwise match every passage
+STOPWORDS = frozenset("""
+    a about above after again against all am an and any are as at be because been before being below
+    between both but by can could did do does doing down during each few for from further give had
+    has have having he her here hers him his how i if in into is it its itself just many me more
+    most much my no nor not now of off on once only or other our ours out over own please same she
+    should show so some such tell than that the their them then there these they this those through
+    to too under until up very was we were what when where which while who whom why will with would
+    you your yours
+""".split())
+# Questions about the document as a whole, answered by map-reduce rather than retrieval
+WHOLE_DOCUMENT_QUERY = re.compile(
+    r'\b(summar\w*|overview|outline|tl;?dr|gist|recap|abstract|key points|main points|whole|entire)\b',
+    re.IGNORECASE
+)
+
+def tokenize_terms(text: str) -> List[str]:
+    return TERM_PATTERN.findall(text.lower())
+
+def query_terms(query: str) -> List[str]:
+    """Distinct query terms, without stopwords."""
+    return list(dict.fromkeys(term for term in tokenize_terms(query) if term not in STOPWORDS))
+
+def encode_array(array: np.ndarray) -> str:
+    return base64.b64encode(array.tobytes()).decode('ascii')
+
+def decode_array(text: str, dtype) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=dtype)
+
+class BM25Index:
+    """Okapi BM25 over the passages of one document, with term-major postings in NumPy arrays."""
+
+    k1 = 1.5
+    b = 0.75
+    format_version = 1
+
+    def __init__(self, vocabulary: Dict[str, int], offsets: np.ndarray, postings: np.ndarray,
+                 frequencies: np.ndarray, lengths: np.ndarray):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.lengths = lengths
+        chunk_count = len(lengths)
+        document_frequency = np.diff(offsets)
+        self.idf = np.log(1 + (chunk_count - document_frequency + 0.5) / (document_frequency + 0.5))
+        self.average_length = max(float(lengths.mean()), 1.0) if chunk_count else 1.0
+
+    @classmethod
+    def build(cls, chunks: List[str]) -> "BM25Index":
+        vocabulary: Dict[str, int] = {}
+        term_lists = [tokenize_terms(chunk) for chunk in chunks]
+        lengths = np.array([len(terms) for terms in term_lists], dtype=np.int32)
+        term_ids = np.fromiter(
+            (vocabulary.setdefault(term, len(vocabulary)) for terms in term_lists for term in terms),
+            dtype=np.int64,
+            count=int(lengths.sum())
+        )
+        chunk_ids = np.repeat(np.arange(len(chunks), dtype=np.int64), lengths)
+        # One (term, chunk) key per occurrence; unique keys sort term-major
+        keys, frequencies = np.unique(term_ids * max(len(chunks), 1) + chunk_ids, return_counts=True)
+        terms = keys // max(len(chunks), 1)
+        offsets = np.searchsorted(terms, np.arange(len(vocabulary) + 1)).astype(np.int32)
+        postings = (keys % max(len(chunks), 1)).astype(np.int32)
+        return cls(vocabulary, offsets, postings, frequencies.astype(np.int32), lengths)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.lengths), dtype=np.float64)
+        for term in query_terms(query):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
                 continue
-                
-            # Save base64 content to a temporary file
-            decoded_content = base64.b64decode(file['base64'])
-            
-            # Detect if the content is an image using imghdr
-            content_stream = io.BytesIO(decoded_content)
-            image_type = imghdr.what(content_stream)
-            is_image = image_type is not None
-            
-            temp_file_path = f"/tmp/temp_file_{file['name']}"
-            with open(temp_file_path, "wb") as f:
-                f.write(decoded_content)
-            
-            # Create appropriate MarkItDown instance based on file type
-            if is_image:
-                vlm_model = os.getenv("OPENROUTER_VLM_MODEL")
-                if not vlm_model:
-                    raise ValueError("OPENROUTER_VLM_MODEL environment variable not set")
-                    
-                logger.info(f"Detected image type: {image_type}, using vision model: {vlm_model}")
-                temp_md = MarkItDown(
-                    llm_client=openai_client,
-                    llm_model=vlm_model
-                )
-            else:
-                model = os.getenv("OPENROUTER_MODEL")
-                if not model:
-                    raise ValueError("OPENROUTER_MODEL environment variable not set")
-                    
-                temp_md = MarkItDown(
-                    llm_client=openai_client,
-                    llm_model=model
-                )
-            
-            # Convert file to markdown using MarkItDown
-            result = temp_md.convert(temp_file_path, use_llm=True)
-            markdown_content = result.text_content
-            
-            # Clean up temporary file
-            os.remove(temp_file_path)
-            
-            # If query is provided, use it with LLM
-            if query:
-                response = openai_client.chat.completions.create(
-                    model=os.getenv("OPENROUTER_MODEL"),
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that processes text based on user queries."},
-                        {"role": "user", "content": f"{query}\n\nText to process:\n{markdown_content}"}
-                    ]
-                )
-                processed_content = response.choices[0].message.content
-                file_content += f"{i}. {file['name']}:\n\n{processed_content}\n\n"
-            else:
-                file_content += f"{i}. {file['name']}:\n\n{markdown_content}\n\n"
-                
-            logger.info(f"Successfully processed {file['name']}")
-            
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            chunk_ids = self.postings[start:end]
+            tf = self.frequencies[start:end]
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_ids] / self.average_length)
+            # Chunk ids are unique within one term's postings
+            scores[chunk_ids] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def top(self, query: str, k: int) -> List[int]:
+        """Ids of the k best-matching chunks with a positive score, in document order."""
+        scores = self.scores(query)
+        best = np.argsort(-scores, kind='stable')[:k]
+        return sorted(int(i) for i in best if scores[i] > 0)
+
+    def coverage(self, query: str, chunk_ids: List[int]) -> float:
+        """Fraction of the query's terms that occur in at least one of chunk_ids."""
+        terms = query_terms(query)
+        if not terms:
+            return 0.0
+        covered = 0
+        for term in terms:
+            term_id = self.vocabulary.get(term)
+            if term_id is not None and np.isin(
+                self.postings[self.offsets[term_id]:self.offsets[term_id + 1]], chunk_ids
+            ).any():
+                covered += 1
+        return covered / len(terms)
+
+    def dumps(self) -> str:
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        return json.dumps({
+            'version': self.format_version,
+            'terms': terms,
+            'offsets': encode_array(self.offsets),
+            'postings': encode_array(self.postings),
+            'frequencies': encode_array(self.frequencies),
+            'lengths': encode_array(self.lengths)
+        })
+
+    @classmethod
+    def loads(cls, payload: str) -> "BM25Index":
+        data = json.loads(payload)
+        if data.get('version') != cls.format_version:
+            raise ValueError(f"Unsupported index format {data.get('version')}")
+        return cls(
+            {term: i for i, term in enumerate(data['terms'])},
+            decode_array(data['offsets'], np.int32),
+            decode_array(data['postings'], np.int32),
+            decode_array(data['frequencies'], np.int32),
+            decode_array(data['lengths'], np.int32)
+        )
+
+retrieval_indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+
+def get_index_key(markdown_content: str) -> str:
+    """Cache key of a document's BM25 index: markdown hash plus passage size."""
+    digest = hashlib.sha256(markdown_content.encode('utf-8')).hexdigest()
+    return f"{digest}:bm25-{RETRIEVAL_CHUNK_TOKENS}-v{BM25Index.format_version}"
+
+async def get_retrieval_index(markdown_content: str, chunks: List[str]) -> BM25Index:
+    """Load a document's BM25 index from memory or the cache backend, building it on a miss."""
+    key = get_index_key(markdown_content)
+    index = retrieval_indexes.get(key)
+    if index is None:
+        try:
+            stored = await document_cache.get_many([key])
+            if key in stored:
+                access_tracker.touch([key])
+                index = BM25Index.loads(stored[key])
+                if len(index.lengths) != len(chunks):
+                    index = None
         except Exception as e:
-            logger.error(f"Error processing file {file['name']}: {str(e)}")
-            # Fallback to direct text conversion if markdown conversion fails
+            logger.error(f"Failed to load retrieval index: {str(e)}")
+        if index is None:
+            index = await asyncio.to_thread(BM25Index.build, chunks)
             try:
-                if is_image:
-                    file_content += f"{i}. {file['name']} (image file - processing failed)\n\n"
-                else:
-                    text_content = decoded_content.decode('utf-8')
-                    file_content += f"{i}. {file['name']} (plain text):\n\n{text_content}\n\n"
-            except:
-                file_content += f"{i}. {file['name']} (failed to process)\n\n"
-    
-    return file_content
+                await document_cache.put_many([
+                    (key, index.dumps(), {'name': 'bm25 index', 'type': 'application/json'})
+                ])
+            except Exception as e:
+                logger.error(f"Failed to store retrieval index: {str(e)}")
+    retrieval_indexes[key] = index
+    retrieval_indexes.move_to_end(key)
+    while len(retrieval_indexes) > RETRIEVAL_INDEX_CACHE_ENTRIES:
+        retrieval_indexes.popitem(last=False)
+    return index
 
-async def get_document_hash(file_data: Dict[str, Any]) -> str:
-    """Generate a unique hash for a document based on its content"""
-    content = file_data.get('base64', '') or file_data.get('content', '')
-    name = file_data.get('name', '')
-    file_type = file_data.get('type', '')
-    
-    # Combine all fields to create a unique hash
-    hash_input = f"{content}{name}{file_type}".encode('utf-8')
-    return hashlib.sha256(hash_input).hexdigest()
+async def retrieve_passages(query: str, markdown_content: str) -> Optional[str]:
+    """The RETRIEVAL_TOP_K passages best matching the query, in document order, or None."""
+    if RETRIEVAL_TOP_K <= 0 or WHOLE_DOCUMENT_QUERY.search(query) or not query_terms(query):
+        return None
+    chunks = split_markdown(markdown_content, RETRIEVAL_CHUNK_TOKENS)
+    index = await get_retrieval_index(markdown_content, chunks)
+    best = index.top(query, RETRIEVAL_TOP_K)
+    # Passages matching only a small part of the query are not a targeted answer
+    if not best or index.coverage(query, best) < RETRIEVAL_MIN_COVERAGE:
+        return None
+    logger.info(f"Retrieved {len(best)} of {len(chunks)} passages for query")
+    return "\n\n[...]\n\n".join(chunks[i] for i in best)
 
-async def store_document_markdown(
-    supabase_client,
-    doc_hash: str,
-    markdown: str,
-    file_data: Dict[str, Any]
-) -> Dict[str, Any]:
-    """Store document markdown in Supabase"""
-    doc_data = {
-        'doc_hash': doc_hash,
-        'file_name': file_data.get('name'),
-        'file_type': file_data.get('type'),
-        'markdown_content': markdown,
-        'created_at': datetime.utcnow().isoformat(),
-        'last_accessed': datetime.utcnow().isoformat()
-    }
-    
-    result = supabase_client.table('document_cache').upsert(doc_data).execute()
-    return result.data[0] if result.data else None
+async def build_document_query_messages(query: str, markdown_content: str, model: str) -> List[Dict[str, str]]:
+    """Messages for the final query call: the whole document, retrieved passages, or map-reduced partial answers."""
+    chunks = split_markdown(markdown_content)
+    if len(chunks) == 1:
+        return build_query_messages(query, markdown_content)
+    passages = await retrieve_passages(query, markdown_content)
+    if passages is not None and estimate_tokens(passages) <= CHUNK_MAX_TOKENS:
+        return build_query_messages(query, passages)
+    logger.info(f"Querying document in {len(chunks)} chunks")
+    partials = await map_chunks(chunks, build_query_chunk_messages(query), model)
+    reduce_messages = build_query_reduce_messages(query)
+    combined = await collapse_partials(partials, reduce_messages, model)
+    return reduce_messages(combined)
 
-async def get_cached_markdown(
-    supabase_client,
-    doc_hash: str
-) -> Optional[str]:
-    """Retrieve cached markdown from Supabase"""
-    result = supabase_client.table('document_cache')\
-        .select('markdown_content')\
-        .eq('doc_hash', doc_hash)\
-        .execute()
+async def run_document_query(query: str, markdown_content: str, model: str) -> str:
+    """Run the query over a document's markdown, hedging the final call if it is short."""
+    messages = await build_document_query_messages(query, markdown_content, model)
+    return await complete_chat(model, messages, hedge=True)
+
+async def stream_document_query(query: str, markdown_content: str, model: str, on_delta) -> str:
+    """Run the query with stream=True, calling on_delta for each token chunk."""
+    messages = await build_document_query_messages(query, markdown_content, model)
+    return await llm_client.stream(model, messages, on_delta)
+
+async def answer_document_query(answer_key: Optional[str], query: str, markdown_content: str) -> str:
+    """Answer a query over a document's markdown, keeping the answer under answer_key."""
+    model = os.getenv("OPENROUTER_MODEL")
+    if answer_key is None:
+        return await run_document_query(query, markdown_content, model)
+    answer = await answer_flights.run(
+        answer_key,
+        lambda: run_document_query(query, markdown_content, model)
+    )
+    if answer:
+        answer_cache.put(answer_key, answer)
+    return answer
+
+async def convert_document(doc_hash: str, file_data: Dict[str, Any]) -> Optional[str]:
+    """Convert a cache miss and keep it in the in-process cache."""
+    markdown = await convert_file_content(file_data, load_file_content(file_data))
+    if markdown:
+        document_memory_cache.put(doc_hash, markdown)
+    return markdown
+
+async def resolve_documents(
+    documents: List[tuple],
+    use_cache: bool = True,
+    errors: Optional[Dict[str, Exception]] = None
+) -> Dict[str, str]:
+    """Resolve (doc_hash, file_data) pairs to markdown, keyed by doc_hash."""
+    resolved: Dict[str, str] = {}
+    if use_cache:
+        for doc_hash, _ in documents:
+            markdown = document_memory_cache.get(doc_hash)
+            if markdown is not None:
+                resolved[doc_hash] = markdown
+        # Keep backend recency current for documents served from memory
+        access_tracker.touch(resolved)
+        
+        remote_hashes = list({doc_hash for doc_hash, _ in documents if doc_hash not in resolved})
+        if remote_hashes:
+            try:
+                found = await document_cache.get_many(remote_hashes)
+            except Exception as e:
+                logger.error(f"Cache lookup failed, converting instead: {str(e)}")
+                found = {}
+            # last_accessed is written later in batches, off the read path
+            access_tracker.touch(found)
+            for doc_hash, markdown in found.items():
+                if markdown:
+                    resolved[doc_hash] = markdown
+                    document_memory_cache.put(doc_hash, markdown)
     
-    if result.data:
-        # Update last accessed timestamp
-        supabase_client.table('document_cache')\
-            .update({'last_accessed': datetime.utcnow().isoformat()})\
-            .eq('doc_hash', doc_hash)\
-            .execute()
-        return result.data[0]['markdown_content']
-    return None
+    misses: Dict[str, Dict[str, Any]] = {}
+    for doc_hash, file_data in documents:
+        if doc_hash not in resolved:
+            misses.setdefault(doc_hash, file_data)
+    if not misses:
+        return resolved
+    
+    # Convert misses. The cache holds the bare markdown so entries can be
+    # shared across file names, and concurrent requests for the same document
+    # share a single conversion.
+    semaphore = asyncio.Semaphore(FILE_CONCURRENCY)
+    
+    async def convert_bounded(doc_hash: str, file_data: Dict[str, Any]) -> Optional[str]:
+        async with semaphore:
+            return await convert_document(doc_hash, file_data)
+    
+    flights = []
+    for doc_hash, file_data in misses.items():
+        task, started = conversion_flights.start(
+            doc_hash,
+            functools.partial(convert_bounded, doc_hash, file_data)
+        )
+        flights.append((doc_hash, file_data, task, started))
+    outcomes = await asyncio.gather(
+        *(asyncio.shield(task) for _, _, task, _ in flights),
+        return_exceptions=True
+    )
+    
+    # Only conversions this request started are written; joined ones are
+    # stored by whichever request started them.
+    to_store = []
+    rejected = None
+    for (doc_hash, file_data, _, started), outcome in zip(flights, outcomes):
+        if isinstance(outcome, Exception):
+            # Failures go to errors so callers don't convert them again; a 503
+            # from a saturated executor is raised once the others are stored
+            logger.error(f"Error processing file {file_data.get('name')}: {str(outcome)}")
+            if isinstance(outcome, HTTPException):
+                rejected = outcome
+            if errors is not None:
+                errors[doc_hash] = outcome
+            continue
+        if outcome:
+            resolved[doc_hash] = outcome
+            if started:
+                to_store.append((doc_hash, outcome, file_data))
+        elif errors is not None:
+            errors[doc_hash] = Exception("No markdown content generated")
+    if to_store:
+        try:
+            await document_cache.put_many(to_store)
+        except Exception as e:
+            logger.error(f"Failed to store {len(to_store)} documents in cache: {str(e)}")
+    if rejected is not None:
+        raise rejected
+    return resolved
+
+def format_cached_entry(name: str, markdown: str) -> str:
+    """Format cached markdown the way the cached endpoint has always returned it."""
+    return f"File content to use as context:\n\n1. {name}:\n\n{markdown}\n\n"
 
 async def process_file_cached(name: str, file_type: str, base64_content: str, model: str, use_cache: bool = True) -> Optional[str]:
     """Process a single file with caching."""
@@ -350,19 +2836,15 @@ async def process_file_cached(name: str, file_type: str, base64_content: str, mo
         # Get document hash
         doc_hash = await get_document_hash(file_data)
         
-        if use_cache:
-            # Try to get cached markdown
-            cached_markdown = await get_cached_markdown(supabase, doc_hash)
-            if cached_markdown:
-                return cached_markdown
-        
-        # Convert file if not in cache
-        markdown = await process_files_to_string([file_data])
-        if markdown:
-            # Store in cache
-            await store_document_markdown(supabase, doc_hash, markdown, file_data)
-            return markdown
+        resolved = await resolve_documents([(doc_hash, file_data)], use_cache=use_cache)
+        markdown = resolved.get(doc_hash)
+        if not markdown:
+            return None
+        
+        return format_cached_entry(name, markdown)
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing file {name}: {str(e)}")
         return None
@@ -372,8 +2854,38 @@ async def file_agent(
     request: AgentRequest,
     authenticated: bool = Depends(verify_token)
 ):
+    return await run_file_agent(request, message_files=request.files)
+
+@app.post("/api/file-agent/upload", response_model=AgentResponse)
+async def file_agent_upload(
+    request: Request,
+    authenticated: bool = Depends(verify_token)
+):
+    """Multipart variant of /api/file-agent: files are sent as form parts instead of base64 JSON."""
+    upload = await read_multipart_upload(request)
     try:
-        logger.info(f"Received request: {request}")
+        agent_request = AgentRequest(
+            query=upload.fields.get('query', ''),
+            user_id=upload.fields.get('user_id', ''),
+            request_id=upload.fields.get('request_id', ''),
+            session_id=upload.fields.get('session_id', ''),
+            files=upload.files or None
+        )
+        # Only metadata goes into the messages table for streamed uploads
+        message_files = [
+            {'name': f['name'], 'type': f['type'], 'size': f['size']} for f in upload.files
+        ]
+        return await run_file_agent(agent_request, message_files=message_files)
+    finally:
+        upload.close()
+
+async def run_file_agent(
+    request: AgentRequest,
+    message_files: Optional[List[Dict[str, Any]]] = None
+) -> AgentResponse:
+    """Shared implementation of the file agent endpoints."""
+    try:
+        logger.info(f"Received request: {request.query} ({len(request.files or [])} files)")
         
         # Fetch conversation history from the DB
         conversation_history = await fetch_conversation_history(request.session_id)
@@ -389,8 +2901,8 @@ async def file_agent(
 
         # Store user's query with files if present
         message_data = {"request_id": request.request_id}
-        if request.files:
-            message_data["files"] = request.files
+        if message_files:
+            message_data["files"] = message_files
 
         await store_message(
             session_id=request.session_id,
@@ -429,43 +2941,191 @@ async def file_agent(
             content="I apologize, but I encountered an error processing your request.",
             data={"error": str(e), "request_id": request.request_id}
         )
+        if isinstance(e, HTTPException):
+            raise
         return AgentResponse(success=False, markdown="", error=str(e))
 
+@app.post("/api/file-agent/stream")
+async def file_agent_stream(
+    request: AgentRequest,
+    authenticated: bool = Depends(verify_token)
+):
+    """Server-sent-events variant of /api/file-agent."""
+    return StreamingResponse(
+        stream_file_agent(request, message_files=request.files),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_file_events(i: int, file: Dict[str, Any], query: str, emit) -> str:
+    """Convert (and query) one file, emitting its events; returns its context entry."""
+    name = file['name']
+    if name.startswith('.'):
+        logger.info(f"Skipping system file: {name}")
+        return ""
+    content = None
+    # Large workbooks report each batch of rows as it is converted
+    conversion_progress.set(
+        lambda part, parts, markdown: emit('partial', {
+            'index': i, 'name': name, 'part': part, 'parts': parts, 'markdown': markdown
+        })
+    )
+    try:
+        content = load_file_content(file)
+        doc_hash = await get_document_hash(file)
+        model = os.getenv("OPENROUTER_MODEL")
+        answer_key = get_answer_key(doc_hash, query, model) if query else None
+        if answer_key:
+            answer = answer_cache.get(answer_key)
+            if answer is not None:
+                emit('answer', {'index': i, 'name': name, 'answer': answer, 'cached': True})
+                return f"{i}. {name}:\n\n{answer}\n\n"
+        
+        errors: Dict[str, Exception] = {}
+        resolved = await resolve_documents([(doc_hash, file)], errors=errors)
+        markdown_content = resolved.get(doc_hash)
+        if not markdown_content:
+            raise errors.get(doc_hash) or Exception("No markdown content generated")
+        emit('file', {'index': i, 'name': name, 'markdown': markdown_content})
+        if not query:
+            return f"{i}. {name}:\n\n{markdown_content}\n\n"
+        
+        answer = await stream_document_query(
+            query,
+            markdown_content,
+            model,
+            lambda delta: emit('token', {'index': i, 'delta': delta})
+        )
+        if answer:
+            answer_cache.put(answer_key, answer)
+        emit('answer', {'index': i, 'name': name, 'answer': answer, 'cached': False})
+        return f"{i}. {name}:\n\n{answer}\n\n"
+    except Exception as e:
+        logger.error(f"Error processing file {name}: {str(e)}")
+        emit('error', {'index': i, 'name': name, 'error': str(e)})
+        return format_fallback_entry(i, name, content)
+
+async def stream_file_agent(
+    request: AgentRequest,
+    message_files: Optional[List[Dict[str, Any]]] = None
+) -> AsyncIterator[str]:
+    """Yield server-sent events for a file agent request as files finish."""
+    logger.info(f"Received streaming request: {request.query} ({len(request.files or [])} files)")
+    message_data = {"request_id": request.request_id}
+    if message_files:
+        message_data["files"] = message_files
+    await store_message(
+        session_id=request.session_id,
+        message_type="human",
+        content=request.query,
+        data=message_data
+    )
+    
+    events: asyncio.Queue = asyncio.Queue()
+    
+    def emit(event: str, data: Dict[str, Any]):
+        events.put_nowait(format_sse(event, data))
+    
+    semaphore = asyncio.Semaphore(FILE_CONCURRENCY)
+    
+    async def process_bounded(i: int, file: Dict[str, Any]) -> str:
+        async with semaphore:
+            return await stream_file_events(i, file, request.query, emit)
+    
+    async def run() -> bool:
+        try:
+            markdown_content = ""
+            if request.files:
+                entries = await asyncio.gather(*(
+                    process_bounded(i, file) for i, file in enumerate(request.files, 1)
+                ))
+                markdown_content = "File content to use as context:\n\n" + "".join(entries)
+            emit('done', {'success': True, 'markdown': markdown_content})
+            return True
+        except Exception as e:
+            logger.error(f"Error processing streaming request: {str(e)}")
+            emit('done', {'success': False, 'markdown': "", 'error': str(e)})
+            return False
+        finally:
+            events.put_nowait(None)
+    
+    task = asyncio.ensure_future(run())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        # Client gone: stop this request's work; shared conversions keep running for their other waiters
+        if not task.done():
+            task.cancel()
+    
+    await store_message(
+        session_id=request.session_id,
+        message_type="ai",
+        content="" if task.result() else "I apologize, but I encountered an error processing your request.",
+        data={"request_id": request.request_id}
+    )
+
 @app.post("/api/convert-to-markdown", response_model=MarkdownResponse)
 async def convert_to_markdown(
     request: FileRequest,
     authenticated: bool = Depends(verify_token)
 ):
     """Convert a single file to markdown format."""
+    return await convert_file_to_markdown(request.file)
+
+@app.post("/api/convert-to-markdown/upload", response_model=MarkdownResponse)
+async def convert_to_markdown_upload(
+    request: Request,
+    authenticated: bool = Depends(verify_token)
+):
+    """Multipart variant of /api/convert-to-markdown: the file is sent as a form part instead of base64 JSON."""
+    upload = await read_multipart_upload(request)
+    try:
+        if not upload.files:
+            return MarkdownResponse(success=False, error="No file provided")
+        return await convert_file_to_markdown(upload.files[0])
+    finally:
+        upload.close()
+
+async def convert_file_to_markdown(file: Dict[str, Any]) -> MarkdownResponse:
+    """Shared implementation of the convert-to-markdown endpoints."""
     try:
-        logger.info(f"Processing file: {request.file['name']}")
+        logger.info(f"Processing file: {file['name']}")
         
-        # Save base64 content to a temporary file
-        decoded_content = base64.b64decode(request.file['base64'])
+        # Decode the upload; conversion works on the bytes in memory
+        decoded_content = read_file_content(file)
         
         # Detect if the content is an image using imghdr
         content_stream = io.BytesIO(decoded_content)
         image_type = imghdr.what(content_stream)
         is_image = image_type is not None
         
-        temp_file_path = f"/tmp/temp_file_{request.file['name']}"
+        extension = get_file_extension(file)
+        mimetype = file.get('type') or ""
         try:
-            with open(temp_file_path, "wb") as f:
-                f.write(decoded_content)
-            logger.info(f"Saved content to temporary file: {temp_file_path}")
-            
             if is_image:
                 logger.info(f"Detected image type: {image_type}, using vision model: {os.getenv('OPENROUTER_VLM_MODEL')}")
                 try:
-                    # Create a new MarkItDown instance with the vision model
-                    temp_md = MarkItDown(
-                        llm_client=openai_client,
-                        llm_model=os.getenv("OPENROUTER_VLM_MODEL")
+                    # Convert with the vision model
+                    markdown_content = await conversion_executor.convert(
+                        decoded_content,
+                        os.getenv("OPENROUTER_VLM_MODEL"),
+                        extension=extension,
+                        mimetype=mimetype,
+                        is_image=True
                     )
-                    result = temp_md.convert(temp_file_path, use_llm=True)
-                    if not result.text_content:
+                    if not markdown_content:
                         raise Exception("Vision model returned empty response")
                     logger.info("Successfully used vision model")
+                except HTTPException:
+                    raise
                 except Exception as vision_error:
                     if "401" in str(vision_error):
                         logger.error(f"Vision model access unauthorized: {str(vision_error)}")
@@ -480,27 +3140,25 @@ async def convert_to_markdown(
                     )
             else:
                 # Use default model for non-image files
-                temp_md = MarkItDown(
-                    llm_client=openai_client,
-                    llm_model=os.getenv("OPENROUTER_MODEL")
+                markdown_content = await conversion_executor.convert(
+                    decoded_content,
+                    os.getenv("OPENROUTER_MODEL"),
+                    extension=extension,
+                    mimetype=mimetype
                 )
-                result = temp_md.convert(temp_file_path, use_llm=True)
             
-            markdown_content = result.text_content
             if not markdown_content:
                 raise Exception("No markdown content generated")
             
             logger.info(f"Successfully converted file. Output length: {len(markdown_content)}")
             
-            # Clean up temporary file
-            os.remove(temp_file_path)
-            logger.info("Cleaned up temporary file")
-            
             return MarkdownResponse(
                 success=True,
                 markdown=markdown_content
             )
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error converting file: {str(e)}")
             # Fallback to direct text conversion if markdown conversion fails
@@ -512,13 +3170,15 @@ async def convert_to_markdown(
                     markdown=text_content
                 )
             except:
-                error_msg = f"Failed to process file {request.file['name']}: {str(e)}"
+                error_msg = f"Failed to process file {file['name']}: {str(e)}"
                 logger.error(error_msg)
                 return MarkdownResponse(
                     success=False,
                     error=error_msg
                 )
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Error processing request: {str(e)}"
         logger.error(error_msg)
@@ -547,8 +3207,9 @@ async def process_files_cached(
                 "markdown": ""
             }
 
-        # Process each file
-        results = []
+        # Hash every file first so the whole request resolves with one
+        # cache lookup and one bulk write
+        documents = []
         for file_data in files:
             try:
                 # Extract file info
@@ -560,22 +3221,26 @@ async def process_files_cached(
                 if not all([name, file_type, base64_content]):
                     continue
 
-                # Process the file
-                result = await process_file_cached(
-                    name=name,
-                    file_type=file_type,
-                    base64_content=base64_content,
-                    model=model,
-                    use_cache=use_cache
-                )
-                
-                if result:
-                    results.append(result)
+                document = {
+                    'name': name,
+                    'type': file_type,
+                    'base64': base64_content,
+                    'model': model
+                }
+                documents.append((await get_document_hash(document), document))
                     
             except Exception as e:
                 logger.error(f"Error processing file {name}: {str(e)}")
                 continue
         
+        # Process the files
+        resolved = await resolve_documents(documents, use_cache=use_cache)
+        results = [
+            format_cached_entry(document['name'], resolved[doc_hash])
+            for doc_hash, document in documents
+            if resolved.get(doc_hash)
+        ]
+        
         # Handle case where no files were successfully processed
         if not results:
             return {
@@ -608,6 +3273,8 @@ async def process_files_cached(
             "markdown": "\n\n".join(results)
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in process_files_cached: {str(e)}")
         return {
@@ -616,6 +3283,242 @@ async def process_files_cached(
             "markdown": ""
         }
 
+@app.get("/api/cache/stats")
+async def cache_stats(authenticated: bool = Depends(verify_token)):
+    """Report counters for the in-process document and answer caches."""
+    return {
+        "memory": document_memory_cache.stats(),
+        "conversions": conversion_flights.stats(),
+        "answers": {**answer_cache.stats(), 'in_flight': answer_flights.stats()['in_flight']},
+        "captions": caption_stage.stats(),
+        "access_updates": access_tracker.stats(),
+        "eviction": cache_evictor.stats(),
+        "backend": document_cache.name
+    }
+
+@app.get("/api/llm/stats")
+async def llm_stats(authenticated: bool = Depends(verify_token)):
+    """Report LLM client counters and rate limiter state for each model called so far."""
+    return {"client": llm_client.stats(), "models": llm_limiter.stats()}
+
+@app.post("/api/cache/evict")
+async def evict_cache(authenticated: bool = Depends(verify_token)):
+    """Run document_cache eviction now and report what was reclaimed."""
+    try:
+        result = await cache_evictor.run_once()
+        return {"success": True, **result}
+    except Exception as e:
+        logger.error(f"Error evicting document cache: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+class ConversionJobQueue:
+    """In-process queue of conversion jobs drained by a fixed number of workers."""
+
+    def __init__(self, workers: int, max_queued: int, max_bytes: int, retention: float):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self.pending_bytes = 0
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, file: Dict[str, Any], size: int, release=None) -> Dict[str, Any]:
+        """Queue a file of size payload bytes for conversion, calling release once it is done; 503 when full."""
+        if self._queue is None:
+            raise HTTPException(status_code=503, detail="Job workers are not running")
+        if size > self.max_bytes:
+            self.rejected += 1
+            raise HTTPException(status_code=413, detail=f"File exceeds the job queue's {self.max_bytes} byte limit")
+        # Payloads stay in memory (or spooled) until their job finishes
+        if self.pending_bytes + size > self.max_bytes:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Job queue is full ({self.pending_bytes} bytes pending), retry later"
+            )
+        self._prune()
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'stage': 'queued',
+            'name': file.get('name', ''),
+            'doc_hash': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None
+        }
+        try:
+            self._queue.put_nowait((job, file, size, release))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Job queue is full ({self.max_queued} jobs waiting), retry later"
+            )
+        self._jobs[job['id']] = job
+        self.pending_bytes += size
+        self.submitted += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished_at'] is not None and job['finished_at'] < cutoff
+        ]:
+            del self._jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            job, file, size, release = await self._queue.get()
+            try:
+                await self._run(job, file)
+            finally:
+                self.pending_bytes -= size
+                if release is not None:
+                    release()
+                self._queue.task_done()
+
+    async def _run(self, job: Dict[str, Any], file: Dict[str, Any]):
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        try:
+            job['stage'] = 'hashing'
+            doc_hash = await get_document_hash(file)
+            job['doc_hash'] = doc_hash
+            job['stage'] = 'converting'
+            # The result stays in the document cache, not on the job
+            resolved = await resolve_documents([(doc_hash, file)])
+            if not resolved.get(doc_hash):
+                raise Exception("No markdown content generated")
+            job['status'] = 'completed'
+            self.completed += 1
+        except Exception as e:
+            logger.error(f"Conversion job {job['id']} for {job['name']} failed: {str(e)}")
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            self.failed += 1
+        finally:
+            job['stage'] = 'done'
+            job['finished_at'] = time.time()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'workers': len(self._tasks),
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'pending_bytes': self.pending_bytes,
+            'tracked': len(self._jobs),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected
+        }
+
+conversion_jobs = ConversionJobQueue(JOB_WORKERS, JOB_QUEUE_SIZE, JOB_QUEUE_MAX_BYTES, JOB_RETENTION_SECONDS)
+
+@app.on_event("startup")
+async def start_conversion_jobs():
+    conversion_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_conversion_jobs():
+    await conversion_jobs.stop()
+
+def get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = conversion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.post("/api/jobs")
+async def create_job(
+    request: FileRequest,
+    authenticated: bool = Depends(verify_token)
+):
+    """Queue a file for background conversion and return its job id immediately."""
+    job = conversion_jobs.submit(request.file, len(request.file.get('base64') or ""))
+    return {"success": True, "job_id": job['id'], "status": job['status']}
+
+@app.post("/api/jobs/upload")
+async def create_job_upload(
+    request: Request,
+    authenticated: bool = Depends(verify_token)
+):
+    """Multipart variant of /api/jobs: the file is spooled as it arrives and kept spooled until its job runs."""
+    upload = await read_multipart_upload(request)
+    if not upload.files:
+        upload.close()
+        return {"success": False, "error": "No file provided"}
+    try:
+        job = conversion_jobs.submit(upload.files[0], upload.files[0]['size'], release=upload.close)
+    except HTTPException:
+        upload.close()
+        raise
+    return {"success": True, "job_id": job['id'], "status": job['status']}
+
+@app.get("/api/jobs")
+async def job_stats(authenticated: bool = Depends(verify_token)):
+    """Report counters for the conversion job queue."""
+    return conversion_jobs.stats()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, authenticated: bool = Depends(verify_token)):
+    """Report a conversion job's status and current stage."""
+    job = get_job_or_404(job_id)
+    finished_at = job['finished_at'] or time.time()
+    return {
+        "success": True,
+        "job_id": job['id'],
+        "status": job['status'],
+        "stage": job['stage'],
+        "name": job['name'],
+        "error": job['error'],
+        "elapsed_seconds": round(finished_at - (job['started_at'] or job['created_at']), 3),
+        "queued_seconds": round((job['started_at'] or finished_at) - job['created_at'], 3)
+    }
+
+@app.get("/api/jobs/{job_id}/result", response_model=MarkdownResponse)
+async def get_job_result(job_id: str, authenticated: bool = Depends(verify_token)):
+    """Return a completed job's markdown, read from the document cache."""
+    job = get_job_or_404(job_id)
+    if job['status'] == 'failed':
+        return MarkdownResponse(success=False, error=job['error'])
+    if job['status'] != 'completed':
+        return MarkdownResponse(success=False, error=f"Job {job_id} is still {job['status']}")
+    try:
+        markdown = document_memory_cache.get(job['doc_hash'])
+        if markdown is None:
+            markdown = await get_cached_markdown(document_cache, job['doc_hash'])
+        if not markdown:
+            return MarkdownResponse(success=False, error="Job result is no longer cached, resubmit the file")
+        return MarkdownResponse(success=True, markdown=markdown)
+    except Exception as e:
+        logger.error(f"Error reading result of job {job_id}: {str(e)}")
+        return MarkdownResponse(success=False, error=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     # Feel free to change the port here if you need
@@ -40,6 +40,7 @@ async def run_tests():
     validation_test.test_openrouter_api()
     validation_test.test_file_processing()
     await validation_test.test_convert_to_markdown()
+    await validation_test.test_convert_to_markdown_upload()
     validation_test.test_file_processing_with_llm()
     validation_test.test_image_processing_with_llm()
     validation_test.test_api_file_agent_cached()
@@ -0,0 +1,72 @@
+-- Track the stored size of each cached document
+alter table document_cache
+    add column if not exists content_bytes bigint
+    generated always as (octet_length(markdown_content)) stored;
+
+-- Eviction scans rows in last_accessed order
+create index if not exists idx_document_cache_last_accessed on document_cache(last_accessed);
+
+-- Evict cached documents older than max_age_seconds, then evict the least
+-- recently accessed documents until the table fits in max_total_bytes.
+-- Either limit may be null to skip it.
+create or replace function evict_document_cache(
+    max_total_bytes bigint default null,
+    max_age_seconds bigint default null
+)
+returns table (
+    expired_rows bigint,
+    expired_bytes bigint,
+    evicted_rows bigint,
+    evicted_bytes bigint,
+    remaining_rows bigint,
+    remaining_bytes bigint
+)
+language plpgsql
+as $$
+begin
+    expired_rows := 0;
+    expired_bytes := 0;
+    evicted_rows := 0;
+    evicted_bytes := 0;
+
+    if max_age_seconds is not null then
+        with deleted as (
+            delete from document_cache
+            where last_accessed < now() - make_interval(secs => max_age_seconds)
+            returning document_cache.content_bytes
+        )
+        select count(*), coalesce(sum(deleted.content_bytes), 0)
+            into expired_rows, expired_bytes
+            from deleted;
+    end if;
+
+    if max_total_bytes is not null then
+        with ranked as (
+            select document_cache.id,
+                   sum(document_cache.content_bytes) over (
+                       order by document_cache.last_accessed desc, document_cache.id desc
+                   ) as running_bytes
+            from document_cache
+        ),
+        deleted as (
+            delete from document_cache
+            using ranked
+            where document_cache.id = ranked.id
+              and ranked.running_bytes > max_total_bytes
+            returning document_cache.content_bytes
+        )
+        select count(*), coalesce(sum(deleted.content_bytes), 0)
+            into evicted_rows, evicted_bytes
+            from deleted;
+    end if;
+
+    select count(*), coalesce(sum(document_cache.content_bytes), 0)
+        into remaining_rows, remaining_bytes
+        from document_cache;
+
+    return next;
+end;
+$$;
+
+-- Notify Supabase of schema changes
+notify pgrst, 'reload schema';
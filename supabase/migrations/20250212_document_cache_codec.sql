@@ -0,0 +1,7 @@
+-- Codec used for markdown_content: 'identity' for plain text, or 'zlib' / 'zstd'
+-- for base64-encoded compressed markdown
+alter table document_cache
+    add column if not exists codec text not null default 'identity';
+
+-- Notify Supabase of schema changes
+notify pgrst, 'reload schema';
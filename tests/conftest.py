@@ -0,0 +1,33 @@
+"""Offline test setup: file_agent reads its settings from the environment at import."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ.setdefault("SUPABASE_URL", "https://test.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "test-service-key")
+os.environ.setdefault("OPENROUTER_API_KEY", "test-openrouter-key")
+os.environ.setdefault("API_BEARER_TOKEN", "test-token")
+os.environ.setdefault("OPENROUTER_MODEL", "test/model")
+os.environ.setdefault("OPENROUTER_VLM_MODEL", "test/vision-model")
+os.environ.setdefault("CONVERSION_EXECUTOR", "thread")
+os.environ.setdefault("CACHE_BACKEND", "disk")
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="file_agent_cache_"))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# file_agent logs to markdown_results/ relative to the working directory
+os.chdir(ROOT)
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    """A fresh thread-backed ConversionExecutor; app shutdown in other tests closes the module-level one."""
+    import file_agent
+    executor = file_agent.ConversionExecutor(
+        kind="thread", conversion_workers=2, llm_workers=1, queue_depth=8, timeout=30
+    )
+    monkeypatch.setattr(file_agent, "conversion_executor", executor)
+    yield executor
+    executor.shutdown()
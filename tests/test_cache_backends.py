@@ -0,0 +1,123 @@
+"""Round trips and eviction order for the offline cache backends."""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import file_agent
+
+
+@pytest.fixture(params=["sqlite", "disk"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return file_agent.SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+    return file_agent.DiskCacheBackend(str(tmp_path / "documents"))
+
+
+def document(doc_hash, markdown):
+    return (doc_hash, markdown, {'name': f"{doc_hash}.md", 'type': 'text/markdown'})
+
+
+def test_get_put_round_trip(backend):
+    large = "# Report\n\n" + "A paragraph that compresses well. " * 200
+    asyncio.run(backend.put_many([document("small:abc", "hello"), document("large:abc", large)]))
+
+    found = asyncio.run(backend.get_many(["small:abc", "large:abc", "missing:abc"]))
+
+    assert found == {"small:abc": "hello", "large:abc": large}
+
+
+def test_put_overwrites_existing_entry(backend):
+    asyncio.run(backend.put_many([document("doc:1", "old")]))
+    asyncio.run(backend.put_many([document("doc:1", "new " * 500)]))
+
+    assert asyncio.run(backend.get_many(["doc:1"])) == {"doc:1": "new " * 500}
+
+
+def test_put_accepts_files_without_name_or_type(backend):
+    asyncio.run(backend.put_many([("doc:1", "text", {})]))
+
+    assert asyncio.run(backend.get_many(["doc:1"])) == {"doc:1": "text"}
+
+
+class RecordingTable:
+    """Minimal stand-in for a postgrest table builder."""
+
+    data = []
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def upsert(self, rows, on_conflict):
+        self.rows.extend(rows)
+        return self
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        self.rows.append(list(values))
+        return self
+
+    def execute(self):
+        return self
+
+
+def test_supabase_put_defaults_missing_name_and_type():
+    rows = []
+    client = type("Client", (), {"table": lambda self, name: RecordingTable(rows)})()
+    backend = file_agent.SupabaseCacheBackend(client)
+
+    asyncio.run(backend.put_many([("doc:1", "text", {'base64': "dGV4dA=="})]))
+
+    assert rows[0]['file_name'] == ''
+    assert rows[0]['file_type'] == ''
+
+
+def test_supabase_get_many_batches_in_filter():
+    filters = []
+    client = type("Client", (), {"table": lambda self, name: RecordingTable(filters)})()
+    backend = file_agent.SupabaseCacheBackend(client)
+    doc_hashes = [f"doc:{n}" for n in range(250)]
+
+    assert asyncio.run(backend.get_many(doc_hashes)) == {}
+
+    assert [len(batch) for batch in filters] == [100, 100, 50]
+    assert sum(filters, []) == doc_hashes
+
+
+def test_evict_drops_least_recently_accessed_first(backend):
+    now = datetime.utcnow()
+    asyncio.run(backend.put_many([document(h, "x" * 100) for h in ("a:1", "b:1", "c:1")]))
+    for offset, doc_hash in enumerate(["b:1", "a:1", "c:1"]):
+        asyncio.run(backend.touch_many([doc_hash], now - timedelta(minutes=10 - offset)))
+
+    result = asyncio.run(backend.evict(max_bytes=250, ttl_seconds=None))
+
+    assert result['evicted_rows'] == 1
+    assert result['remaining_rows'] == 2
+    assert set(asyncio.run(backend.get_many(["a:1", "b:1", "c:1"]))) == {"a:1", "c:1"}
+
+
+def test_evict_expires_idle_entries(backend):
+    now = datetime.utcnow()
+    asyncio.run(backend.put_many([document("idle:1", "old"), document("fresh:1", "new")]))
+    asyncio.run(backend.touch_many(["idle:1"], now - timedelta(days=2)))
+    asyncio.run(backend.touch_many(["fresh:1"], now))
+
+    result = asyncio.run(backend.evict(max_bytes=None, ttl_seconds=24 * 3600))
+
+    assert result['expired_rows'] == 1
+    assert result['remaining_rows'] == 1
+    assert asyncio.run(backend.get_many(["idle:1", "fresh:1"])) == {"fresh:1": "new"}
+
+
+def test_touch_keeps_recent_entry_under_budget(backend):
+    now = datetime.utcnow()
+    asyncio.run(backend.put_many([document(h, "y" * 100) for h in ("old:1", "new:1")]))
+    asyncio.run(backend.touch_many(["new:1"], now - timedelta(minutes=5)))
+    asyncio.run(backend.touch_many(["old:1"], now))
+
+    asyncio.run(backend.evict(max_bytes=150, ttl_seconds=None))
+
+    assert set(asyncio.run(backend.get_many(["old:1", "new:1"]))) == {"old:1"}
@@ -0,0 +1,139 @@
+"""Markdown chunking and BM25 retrieval helpers."""
+import asyncio
+
+import file_agent
+
+
+def test_pack_pieces_respects_budget_and_order():
+    pieces = ["a" * 40, "b" * 40, "c" * 40, "d" * 40]  # 11 estimated tokens each
+
+    groups = file_agent.pack_pieces(pieces, max_tokens=25)
+
+    assert groups == ["a" * 40 + "b" * 40, "c" * 40 + "d" * 40]
+
+
+def test_pack_pieces_keeps_oversized_piece_alone():
+    groups = file_agent.pack_pieces(["x" * 400, "y"], max_tokens=10, separator="\n")
+
+    assert groups == ["x" * 400, "y"]
+
+
+def test_split_oversized_falls_back_to_lines_then_characters():
+    section = "\n".join(["word " * 30] * 4)
+
+    pieces = file_agent.split_oversized(section, max_tokens=50)
+
+    assert "".join(pieces) == section
+    assert all(file_agent.estimate_tokens(piece) <= 50 for piece in pieces)
+    assert file_agent.split_oversized("z" * 1000, max_tokens=50) == ["z" * 200] * 5
+
+
+def test_short_markdown_is_one_chunk():
+    assert file_agent.split_markdown("# Title\n\nShort.", max_tokens=100) == ["# Title\n\nShort."]
+
+
+def test_split_markdown_breaks_at_headings_and_keeps_text():
+    sections = [f"## Section {i}\n\n" + f"Sentence {i}. " * 40 + "\n\n" for i in range(6)]
+    markdown = "".join(sections)
+
+    chunks = file_agent.split_markdown(markdown, max_tokens=300)
+
+    assert "".join(chunks) == markdown
+    assert len(chunks) > 1
+    assert all(chunk.startswith("## Section") for chunk in chunks)
+    assert all(file_agent.estimate_tokens(chunk) <= 300 for chunk in chunks)
+
+
+def test_split_markdown_keeps_slide_marker_with_its_title():
+    slides = "".join(
+        f"<!-- Slide number: {i} -->\n# Slide {i}\n\n" + "Bullet point text. " * 30 + "\n\n"
+        for i in range(1, 5)
+    )
+
+    chunks = file_agent.split_markdown(slides, max_tokens=200)
+
+    assert "".join(chunks) == slides
+    assert all(chunk.startswith("<!-- Slide number: ") for chunk in chunks)
+
+
+def test_split_markdown_breaks_at_page_breaks():
+    pages = ["Page text. " * 60 for _ in range(3)]
+
+    chunks = file_agent.split_markdown("\f".join(pages), max_tokens=200)
+
+    assert chunks == pages
+
+
+PASSAGES = [
+    "The zebra population grew by twelve percent in 2023.",
+    "Quarterly revenue for the retail segment was flat.",
+    "Zebra herds migrate north during the dry season, zebra foals follow.",
+    "Staff headcount rose after the new warehouse opened.",
+]
+
+
+def test_bm25_ranks_matching_passages_in_document_order():
+    index = file_agent.BM25Index.build(PASSAGES)
+
+    assert index.top("zebra migration", k=2) == [0, 2]
+    assert index.top("warehouse headcount", k=1) == [3]
+    assert index.top("photosynthesis", k=3) == []
+
+
+def test_bm25_scores_favour_higher_term_frequency():
+    scores = file_agent.BM25Index.build(PASSAGES).scores("zebra")
+
+    assert scores[2] > scores[0] > 0
+    assert scores[1] == scores[3] == 0
+
+
+def test_bm25_round_trips_through_dumps():
+    index = file_agent.BM25Index.build(PASSAGES)
+
+    loaded = file_agent.BM25Index.loads(index.dumps())
+
+    assert loaded.vocabulary == index.vocabulary
+    assert (loaded.scores("zebra revenue") == index.scores("zebra revenue")).all()
+
+
+def test_bm25_ignores_stopwords():
+    index = file_agent.BM25Index.build(PASSAGES)
+
+    assert not index.scores("what is the of this").any()
+    assert index.top("what is the zebra population", k=1) == [0]
+
+
+def test_bm25_coverage_counts_query_terms_found():
+    index = file_agent.BM25Index.build(PASSAGES)
+
+    assert index.coverage("zebra revenue", [0]) == 0.5
+    assert index.coverage("zebra revenue", [0, 1]) == 1.0
+    assert index.coverage("the of", [0, 1]) == 0.0
+
+
+def retrieval_document():
+    sections = [f"## Section {i}\n\n" + f"Filler text about topic {i}. " * 60 for i in range(40)]
+    sections[17] += "\n\nThe zebra population grew by twelve percent in 2023.\n"
+    return "\n\n".join(sections)
+
+
+def test_retrieval_answers_targeted_questions():
+    passages = asyncio.run(file_agent.retrieve_passages(
+        "How much did the zebra population grow?", retrieval_document()
+    ))
+
+    assert passages is not None
+    assert "zebra population grew" in passages
+
+
+def test_retrieval_leaves_whole_document_questions_to_map_reduce():
+    document = retrieval_document()
+
+    for query in ["Please summarize the whole document", "Give me an overview of this", "what is this about?"]:
+        assert asyncio.run(file_agent.retrieve_passages(query, document)) is None
+
+
+def test_retrieval_requires_query_coverage():
+    query = "zebra migration weather forecasts antelope"
+
+    assert asyncio.run(file_agent.retrieve_passages(query, retrieval_document())) is None
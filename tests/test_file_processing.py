@@ -0,0 +1,52 @@
+"""Per-file processing in the file agent, with conversion stubbed out."""
+import asyncio
+import base64
+import uuid
+
+import file_agent
+
+
+def make_file(name):
+    # Unique bytes so earlier tests' cache entries never match
+    content = f"{name} {uuid.uuid4()}".encode()
+    return {'name': name, 'base64': base64.b64encode(content).decode()}
+
+
+def test_failed_conversion_is_not_retried(monkeypatch):
+    attempts = []
+
+    async def failing_convert(file, content):
+        attempts.append(file['name'])
+        raise ValueError("converter crashed")
+
+    monkeypatch.setattr(file_agent, "convert_file_content", failing_convert)
+
+    result = asyncio.run(file_agent.process_files_to_string([make_file("broken.docx")]))
+
+    assert attempts == ["broken.docx"]
+    assert "1. broken.docx (plain text)" in result
+
+
+def test_converted_files_keep_their_order(monkeypatch):
+    async def convert(file, content):
+        await asyncio.sleep(0.01 if file['name'] == "first.txt" else 0)
+        return f"markdown of {file['name']}"
+
+    monkeypatch.setattr(file_agent, "convert_file_content", convert)
+
+    result = asyncio.run(file_agent.process_files_to_string([make_file("first.txt"), make_file("second.txt")]))
+
+    assert result.index("1. first.txt:\n\nmarkdown of first.txt") < result.index("2. second.txt:\n\nmarkdown of second.txt")
+
+
+def test_client_supplied_hash_and_content_are_ignored():
+    victim = make_file("report.txt")
+    victim_hash = asyncio.run(file_agent.get_document_hash(dict(victim)))
+    attacker = make_file("report.txt")
+    attacker['sha256'] = victim_hash.split(':')[0]
+    attacker['content'] = "not bytes"
+
+    attacker_hash = asyncio.run(file_agent.get_document_hash(attacker))
+
+    assert attacker_hash != victim_hash
+    assert attacker_hash.split(':')[0] == file_agent.hashlib.sha256(base64.b64decode(attacker['base64'])).hexdigest()
@@ -0,0 +1,123 @@
+"""Background conversion jobs, end to end through the API with conversion stubbed out."""
+import asyncio
+import base64
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import file_agent
+
+HEADERS = {"Authorization": "Bearer test-token"}
+
+
+class FakeDocumentCacheTable:
+    """Enough of the postgrest builder for SupabaseCacheBackend, enforcing file_type NOT NULL."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = None
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        self.result = [row for key, row in self.rows.items() if key in values]
+        return self
+
+    def upsert(self, rows, on_conflict):
+        if any(row['file_type'] is None for row in rows):
+            raise Exception('null value in column "file_type" violates not-null constraint')
+        self.rows.update({row['doc_hash']: row for row in rows})
+        return self
+
+    def update(self, values):
+        return self
+
+    def execute(self):
+        return type("Response", (), {"data": self.result})()
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.rows = {}
+
+    def table(self, name):
+        return FakeDocumentCacheTable(self.rows)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def convert(file, content):
+        return f"# {file['name']}\n\n{content.decode()}"
+
+    monkeypatch.setattr(file_agent, "convert_file_content", convert)
+    monkeypatch.setattr(file_agent, "document_cache", file_agent.SupabaseCacheBackend(FakeSupabase()))
+    with TestClient(file_agent.app) as test_client:
+        yield test_client
+
+
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/jobs/{job_id}", headers=HEADERS).json()
+        if job['status'] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_result_of_file_without_type_survives_memory_eviction(client, monkeypatch):
+    content = f"quarterly numbers {uuid.uuid4()}".encode()
+    file = {"name": "report.txt", "base64": base64.b64encode(content).decode()}
+
+    job_id = client.post("/api/jobs", headers=HEADERS, json={"file": file}).json()['job_id']
+    assert wait_for_job(client, job_id)['status'] == "completed"
+    # The result must now come from the cache backend
+    monkeypatch.setattr(file_agent, "document_memory_cache", file_agent.DocumentLRUCache(16, 1024 * 1024))
+
+    result = client.get(f"/api/jobs/{job_id}/result", headers=HEADERS).json()
+
+    assert result['success'] is True
+    assert result['markdown'] == f"# report.txt\n\n{content.decode()}"
+
+
+def test_unknown_job_is_404(client):
+    assert client.get("/api/jobs/missing", headers=HEADERS).status_code == 404
+
+
+def test_multipart_job_is_converted_and_its_spool_released(client, monkeypatch):
+    released = []
+    close = file_agent.MultipartUpload.close
+    monkeypatch.setattr(file_agent.MultipartUpload, "close", lambda self: released.append(True) or close(self))
+    content = f"uploaded numbers {uuid.uuid4()}".encode()
+
+    response = client.post("/api/jobs/upload", headers=HEADERS, files={"file": ("upload.txt", content, "text/plain")})
+    job_id = response.json()['job_id']
+
+    assert wait_for_job(client, job_id)['status'] == "completed"
+    assert released == [True]
+    result = client.get(f"/api/jobs/{job_id}/result", headers=HEADERS).json()
+    assert result['markdown'] == f"# upload.txt\n\n{content.decode()}"
+    assert client.get("/api/jobs", headers=HEADERS).json()['pending_bytes'] == 0
+
+
+def test_queue_is_bounded_by_pending_bytes():
+    jobs = file_agent.ConversionJobQueue(workers=1, max_queued=10, max_bytes=100, retention=60)
+
+    async def submit_all():
+        jobs.start()
+        try:
+            jobs.submit({'name': "a.txt"}, 60)
+            with pytest.raises(file_agent.HTTPException) as full:
+                jobs.submit({'name': "b.txt"}, 60)
+            with pytest.raises(file_agent.HTTPException) as too_large:
+                jobs.submit({'name': "c.txt"}, 200)
+            return full.value.status_code, too_large.value.status_code
+        finally:
+            await jobs.stop()
+
+    assert asyncio.run(submit_all()) == (503, 413)
+    assert jobs.pending_bytes == 60
+    assert jobs.rejected == 2
@@ -0,0 +1,191 @@
+"""LLMClient retries, deadlines, streaming and hedging against a fake AsyncOpenAI client."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import file_agent
+
+MODEL = "test/model"
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class APIError(Exception):
+    def __init__(self, status_code, retry_after="0"):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={'retry-after': retry_after})
+
+
+def response(text):
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    """Plays one scripted step per create() call: an exception to raise, or a coroutine function to await."""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def create(self, model, messages, stream=False):
+        self.calls += 1
+        step = self.steps.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return await step()
+
+
+def make_client(steps, deadline=5.0, max_retries=3, hedge_max_tokens=0, hedge_min_samples=1):
+    completions = FakeCompletions(steps)
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    client = file_agent.LLMClient(
+        fake, deadline=deadline, max_retries=max_retries, base_delay=0.01, max_delay=0.02,
+        hedge_max_tokens=hedge_max_tokens, hedge_min_samples=hedge_min_samples, latency_window=50
+    )
+    return client, completions
+
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch):
+    limiter = file_agent.LLMRateLimiter(0, 0, 1, 8, 3.0, {})
+    monkeypatch.setattr(file_agent, "llm_limiter", limiter)
+    return limiter
+
+
+def returns(value, delay=0.0):
+    async def step():
+        await asyncio.sleep(delay)
+        return value
+    return step
+
+
+@pytest.mark.parametrize("error", [
+    APIError(429),
+    APIError(503),
+    APIError(408),
+    file_agent.APIConnectionError(request=httpx.Request("POST", "https://openrouter.ai/api/v1")),
+])
+def test_transient_errors_are_retried(error):
+    client, completions = make_client([error, returns(response("answer"))])
+
+    result = asyncio.run(client.complete(MODEL, MESSAGES))
+
+    assert result.choices[0].message.content == "answer"
+    assert completions.calls == 2
+    assert client.retries == 1
+
+
+@pytest.mark.parametrize("status", [400, 401, 404])
+def test_client_errors_are_not_retried(status):
+    client, completions = make_client([APIError(status), returns(response("unused"))])
+
+    with pytest.raises(APIError):
+        asyncio.run(client.complete(MODEL, MESSAGES))
+
+    assert completions.calls == 1
+    assert client.retries == 0
+
+
+def test_deadline_covers_time_queued_in_the_limiter(limiter):
+    limiter.rpm = 60
+    limiter.for_model(MODEL).requests.level = 0.0  # Next request admitted in about 1s
+    client, completions = make_client([returns(response("late"))], deadline=0.2)
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(client.complete(MODEL, MESSAGES))
+
+    assert time.monotonic() - started < 0.6
+    assert completions.calls == 0
+    assert client.deadline_exceeded == 1
+
+
+def test_backoff_past_the_deadline_raises_without_sleeping():
+    client, completions = make_client([APIError(429, retry_after="5"), returns(response("unused"))], deadline=1.0)
+
+    started = time.monotonic()
+    with pytest.raises(APIError):
+        asyncio.run(client.complete(MODEL, MESSAGES))
+
+    assert time.monotonic() - started < 0.5
+    assert completions.calls == 1
+
+
+def test_stream_retries_before_the_first_token():
+    async def stream():
+        async def chunks():
+            yield chunk("Hello")
+            yield chunk(" world")
+        return chunks()
+
+    client, completions = make_client([APIError(429), stream])
+    deltas = []
+
+    assert asyncio.run(client.stream(MODEL, MESSAGES, deltas.append)) == "Hello world"
+    assert deltas == ["Hello", " world"]
+    assert completions.calls == 2
+
+
+def test_stream_is_not_retried_after_the_first_token():
+    async def broken_stream():
+        async def chunks():
+            yield chunk("Hello")
+            raise APIError(503)
+        return chunks()
+
+    client, completions = make_client([broken_stream, returns(None)])
+    deltas = []
+
+    with pytest.raises(APIError):
+        asyncio.run(client.stream(MODEL, MESSAGES, deltas.append))
+
+    assert deltas == ["Hello"]
+    assert completions.calls == 1
+    assert client.retries == 0
+
+
+def test_slow_call_is_hedged_after_p95_and_the_loser_cancelled():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(2)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return response("primary")
+
+    client, completions = make_client([slow, returns(response("backup"))], hedge_max_tokens=1000)
+    client._record_latency(MODEL, 0.05)
+
+    async def hedged_call():
+        result = await client.complete(MODEL, MESSAGES, hedge=True)
+        await asyncio.sleep(0)  # Let the cancelled primary unwind
+        return result
+
+    started = time.monotonic()
+    result = asyncio.run(hedged_call())
+
+    assert result.choices[0].message.content == "backup"
+    assert time.monotonic() - started < 1
+    assert completions.calls == 2
+    assert cancelled == [True]
+    assert (client.hedged, client.hedge_wins) == (1, 1)
+
+
+def test_fast_call_is_not_hedged():
+    client, completions = make_client([returns(response("primary"))], hedge_max_tokens=1000)
+    client._record_latency(MODEL, 0.5)
+
+    result = asyncio.run(client.complete(MODEL, MESSAGES, hedge=True))
+
+    assert result.choices[0].message.content == "primary"
+    assert completions.calls == 1
+    assert (client.hedged, client.hedge_wins) == (0, 0)
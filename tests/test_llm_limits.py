@@ -0,0 +1,128 @@
+"""ModelRateLimiter: token buckets, AIMD concurrency and Retry-After, driven by fake calls."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import file_agent
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after="0"):
+        super().__init__("429 Too Many Requests")
+        self.response = SimpleNamespace(headers={'retry-after': retry_after})
+
+
+def make_limiter(rpm=0, tpm=0, min_concurrency=1, max_concurrency=8):
+    return file_agent.ModelRateLimiter(rpm, tpm, min_concurrency, max_concurrency, spike_factor=3.0)
+
+
+async def succeed(delay=0.0):
+    await asyncio.sleep(delay)
+    return "ok"
+
+
+async def throttled():
+    await asyncio.sleep(0.01)
+    raise RateLimited()
+
+
+async def raise_rate_limited(retry_after):
+    raise RateLimited(retry_after)
+
+
+def test_429s_from_one_round_halve_the_limit_once():
+    limiter = make_limiter(max_concurrency=8)
+
+    async def round_of_failures():
+        return await asyncio.gather(*(limiter.run(10, throttled) for _ in range(4)), return_exceptions=True)
+
+    outcomes = asyncio.run(round_of_failures())
+
+    assert all(isinstance(outcome, RateLimited) for outcome in outcomes)
+    assert limiter.limit == 4
+    assert limiter.decreases == 1
+    assert limiter.throttled == 4
+    assert limiter.in_flight == 0
+
+
+def test_a_later_round_of_429s_halves_again():
+    limiter = make_limiter(max_concurrency=8)
+
+    async def two_rounds():
+        for _ in range(2):
+            await asyncio.gather(*(limiter.run(10, throttled) for _ in range(2)), return_exceptions=True)
+
+    asyncio.run(two_rounds())
+
+    assert limiter.limit == 2
+    assert limiter.decreases == 2
+
+
+def test_a_round_of_successes_grows_the_limit_by_about_one():
+    limiter = make_limiter(max_concurrency=16)
+    limiter.limit = 4.0
+
+    async def one_round():
+        for _ in range(4):
+            await limiter.run(10, succeed, watch_latency=False)
+
+    asyncio.run(one_round())
+
+    assert 4.8 < limiter.limit <= 5.0
+
+
+def test_concurrency_never_exceeds_the_limit():
+    limiter = make_limiter(max_concurrency=3)
+    active = 0
+    peak = 0
+
+    async def call():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return "ok"
+
+    async def burst():
+        return await asyncio.gather(*(limiter.run(10, call, watch_latency=False) for _ in range(12)))
+
+    assert asyncio.run(burst()) == ["ok"] * 12
+    assert peak == 3
+    assert limiter.in_flight == 0
+
+
+def test_call_waits_for_a_drained_request_bucket():
+    limiter = make_limiter(rpm=600)  # One request per 0.1s
+    limiter.requests.level = 0.0
+
+    started = time.monotonic()
+    asyncio.run(limiter.run(10, succeed))
+
+    assert time.monotonic() - started >= 0.09
+    assert limiter.wait_seconds >= 0.09
+
+
+def test_retry_after_pauses_the_next_call():
+    limiter = make_limiter()
+
+    async def throttled_then_retry():
+        with pytest.raises(RateLimited):
+            await limiter.run(10, lambda: raise_rate_limited("0.2"))
+        started = time.monotonic()
+        await limiter.run(10, succeed)
+        return time.monotonic() - started
+
+    assert asyncio.run(throttled_then_retry()) >= 0.19
+
+
+def test_token_estimate_is_corrected_after_the_call():
+    limiter = make_limiter(tpm=10000)
+
+    asyncio.run(limiter.run(100, succeed, count_tokens=lambda result: 500))
+
+    assert limiter.tokens.level == pytest.approx(9500, abs=5)
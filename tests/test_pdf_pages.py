@@ -0,0 +1,113 @@
+"""Page-parallel PDF conversion: page hashing and parity with MarkItDown."""
+import asyncio
+import io
+
+import pytest
+from markitdown import MarkItDown
+
+import file_agent
+
+pytestmark = [
+    pytest.mark.skipif(file_agent.PDFPage is None, reason="pdfminer/pdfplumber not installed"),
+    pytest.mark.usefixtures("executor"),
+]
+
+
+def text_ops(lines, x=72, y=720):
+    return "BT /F1 12 Tf 14 TL %d %d Td " % (x, y) + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+
+
+def table_ops(rows, y=720):
+    cells = []
+    for row in rows:
+        for column, cell in enumerate(row):
+            cells.append(f"BT /F1 10 Tf {72 + 150 * column} {y} Td ({cell}) Tj ET")
+        y -= 16
+    return " ".join(cells)
+
+
+def make_pdf(pages):
+    """Minimal PDF; each page is (content ops, Form XObject ops or None), the form drawn as /X1."""
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for ops, form_ops in pages:
+        xobject = ""
+        if form_ops is not None:
+            objects.append(
+                f"<< /Type /XObject /Subtype /Form /BBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+                f"/Length {len(form_ops)} >>\nstream\n{form_ops}\nendstream".encode()
+            )
+            xobject = f"/XObject << /X1 {len(objects)} 0 R >>"
+            ops += " /X1 Do"
+        objects.append(f"<< /Length {len(ops)} >>\nstream\n{ops}\nendstream".encode())
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> {xobject} >> /Contents {len(objects)} 0 R >>".encode()
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def markitdown_text(content):
+    return MarkItDown().convert_stream(io.BytesIO(content), file_extension=".pdf").text_content
+
+
+@pytest.fixture
+def parallel_pdf(monkeypatch):
+    monkeypatch.setattr(file_agent, "PDF_PARALLEL_MIN_PAGES", 2)
+    monkeypatch.setattr(file_agent, "PDF_PAGES_PER_TASK", 2)
+
+
+def test_page_hash_covers_form_xobject_text():
+    first = make_pdf([(text_ops(["Header"]), text_ops(["Total due: 100"], y=400))])
+    second = make_pdf([(text_ops(["Header"]), text_ops(["Total due: 900"], y=400))])
+
+    assert file_agent.hash_pdf_pages_sync(first) != file_agent.hash_pdf_pages_sync(second)
+    assert file_agent.hash_pdf_pages_sync(first) == file_agent.hash_pdf_pages_sync(first)
+
+
+def test_prose_pdf_matches_markitdown(parallel_pdf):
+    content = make_pdf([
+        (text_ops([f"Page {number} introduction", "A second line of prose."]), None)
+        for number in range(5)
+    ])
+
+    assert asyncio.run(file_agent.convert_pdf_pages(content)) == markitdown_text(content)
+
+
+def test_table_pdf_matches_markitdown(parallel_pdf):
+    rows = [("Item", "Quantity", "Price")] + [(f"Widget {n}", str(n), f"{n * 3}.00") for n in range(1, 9)]
+    content = make_pdf([
+        (text_ops(["Quarterly report", "Prose before the tables."]), None),
+        (table_ops(rows), None),
+        (text_ops(["Closing remarks."]), None),
+        (table_ops(rows[:5]), None),
+    ])
+
+    markdown = asyncio.run(file_agent.convert_pdf_pages(content))
+
+    assert markdown == markitdown_text(content)
+    assert "|" in markdown
+
+
+def test_short_pdf_is_left_to_markitdown_without_hashing(monkeypatch):
+    hashed = []
+    monkeypatch.setattr(file_agent, "PDF_PARALLEL_MIN_PAGES", 3)
+    monkeypatch.setattr(file_agent, "hash_pdf_pages_sync", lambda content: hashed.append(content) or [])
+    content = make_pdf([(text_ops(["Only page"]), None), (text_ops(["Second page"]), None)])
+
+    assert file_agent.count_pdf_pages_sync(content) == 2
+    assert asyncio.run(file_agent.convert_pdf_pages(content)) is None
+    assert hashed == []
@@ -0,0 +1,108 @@
+"""Multipart upload endpoints, offline through TestClient."""
+import pytest
+from fastapi.testclient import TestClient
+
+import file_agent
+
+HEADERS = {"Authorization": "Bearer test-token"}
+
+
+@pytest.fixture
+def client():
+    with TestClient(file_agent.app) as test_client:
+        yield test_client
+
+
+def test_small_file_is_converted(client):
+    response = client.post(
+        "/api/convert-to-markdown/upload",
+        headers=HEADERS,
+        files={"file": ("notes.txt", b"plain text upload", "text/plain")}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"success": True, "markdown": "plain text upload", "error": ""}
+
+
+def test_oversized_file_is_rejected_by_content_length(client, monkeypatch):
+    monkeypatch.setattr(file_agent, "MAX_UPLOAD_BYTES", 1024)
+
+    response = client.post(
+        "/api/convert-to-markdown/upload",
+        headers=HEADERS,
+        files={"file": ("big.txt", b"x" * 4096, "text/plain")}
+    )
+
+    assert response.status_code == 413
+
+
+def test_oversized_file_is_rejected_while_streaming(client, monkeypatch):
+    monkeypatch.setattr(file_agent, "MAX_UPLOAD_BYTES", 1024)
+    body = (
+        b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.txt\"\r\n"
+        b"Content-Type: text/plain\r\n\r\n" + b"x" * 4096 + b"\r\n--b--\r\n"
+    )
+
+    def chunks():
+        # No Content-Length: the limit has to be enforced on the bytes received
+        for start in range(0, len(body), 512):
+            yield body[start:start + 512]
+
+    response = client.post(
+        "/api/convert-to-markdown/upload",
+        headers={**HEADERS, "Content-Type": "multipart/form-data; boundary=b"},
+        content=chunks()
+    )
+
+    assert response.status_code == 413
+
+
+def test_non_multipart_body_is_rejected(client):
+    response = client.post(
+        "/api/convert-to-markdown/upload",
+        headers=HEADERS,
+        json={"file": {"name": "notes.txt", "base64": "aGVsbG8="}}
+    )
+
+    assert response.status_code == 400
+
+
+def test_file_agent_upload_passes_fields_and_files(client, monkeypatch):
+    stored = []
+    processed = []
+
+    async def no_history(session_id, limit=10):
+        return []
+
+    async def store_message(session_id, message_type, content, data=None):
+        stored.append((session_id, message_type, content, data))
+
+    async def process_files(files, query=""):
+        processed.append((query, [(f['name'], file_agent.read_file_content(f)) for f in files]))
+        return "converted"
+
+    monkeypatch.setattr(file_agent, "fetch_conversation_history", no_history)
+    monkeypatch.setattr(file_agent, "store_message", store_message)
+    monkeypatch.setattr(file_agent, "process_files_to_string", process_files)
+
+    response = client.post(
+        "/api/file-agent/upload",
+        headers=HEADERS,
+        data={"query": "Summarize", "session_id": "s1", "user_id": "u1", "request_id": "r1"},
+        files=[
+            ("files", ("a.txt", b"first file", "text/plain")),
+            ("files", ("b.csv", b"x,y\n1,2", "text/csv")),
+        ]
+    )
+
+    assert response.json() == {"success": True, "markdown": "converted", "error": ""}
+    assert processed == [("Summarize", [("a.txt", b"first file"), ("b.csv", b"x,y\n1,2")])]
+    session_id, message_type, content, data = stored[0]
+    assert (session_id, message_type, content) == ("s1", "human", "Summarize")
+    assert data == {
+        "request_id": "r1",
+        "files": [
+            {"name": "a.txt", "type": "text/plain", "size": 10},
+            {"name": "b.csv", "type": "text/csv", "size": 7},
+        ]
+    }
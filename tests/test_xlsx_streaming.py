@@ -0,0 +1,78 @@
+"""Streamed conversion of large workbooks."""
+import asyncio
+import base64
+import io
+
+import pytest
+
+import file_agent
+
+openpyxl = pytest.importorskip("openpyxl")
+
+pytestmark = pytest.mark.usefixtures("executor")
+
+
+def make_workbook(sheets):
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        for row in rows:
+            worksheet.append(row)
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def convert(content):
+    reported = []
+    async def run():
+        file_agent.conversion_progress.set(lambda part, parts, markdown: reported.append((part, markdown)))
+        return await file_agent.convert_xlsx_workbook(content)
+    return asyncio.run(run()), reported
+
+
+def test_each_row_batch_is_reported_in_order(monkeypatch):
+    monkeypatch.setattr(file_agent, "XLSX_ROW_BATCH", 2)
+    content = make_workbook({
+        "Orders": [["id", "item"]] + [[n, f"item {n}"] for n in range(1, 6)],
+        "Notes": [["note"], ["a|b"]],
+    })
+
+    markdown, reported = convert(content)
+
+    assert [part for part, _ in reported] == [1, 2, 3, 4]
+    assert "".join(text for _, text in reported).strip() == markdown
+    assert markdown == (
+        "## Orders\n| id | item |\n| --- | --- |\n"
+        "| 1 | item 1 |\n| 2 | item 2 |\n| 3 | item 3 |\n| 4 | item 4 |\n| 5 | item 5 |\n"
+        "\n## Notes\n| note |\n| --- |\n| a\\|b |"
+    )
+
+
+def test_unreadable_workbook_raises_instead_of_waiting():
+    with pytest.raises(Exception):
+        convert(b"PK\x03\x04 not really a workbook")
+
+
+def test_streamed_workbooks_have_their_own_cache_key(monkeypatch):
+    encoded = base64.b64encode(make_workbook({"Sheet": [["a"], [1]]})).decode()
+    monkeypatch.setattr(file_agent, "XLSX_STREAMING_MIN_BYTES", 1)
+    streamed = asyncio.run(file_agent.get_document_hash({'name': "book.xlsx", 'base64': encoded}))
+    monkeypatch.setattr(file_agent, "XLSX_STREAMING_MIN_BYTES", 0)
+    whole = asyncio.run(file_agent.get_document_hash({'name': "book.xlsx", 'base64': encoded}))
+
+    assert streamed != whole
+
+
+def test_batches_do_not_wait_on_the_default_executor(monkeypatch):
+    async def no_default_executor(*args, **kwargs):
+        raise AssertionError("streamed workbook used asyncio.to_thread")
+
+    monkeypatch.setattr(file_agent.asyncio, "to_thread", no_default_executor)
+    content = make_workbook({"Sheet": [["a"], [1], [2]]})
+
+    markdown, reported = convert(content)
+
+    assert markdown == "## Sheet\n| a |\n| --- |\n| 1 |\n| 2 |"
+    assert len(reported) == 1
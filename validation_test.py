@@ -688,6 +688,32 @@ async def test_file_agent_cached_api():
         print(f"✗ First request failed")
         print(f"  Error: {response.text}")
 
+async def test_convert_to_markdown_upload():
+    """Test the multipart /api/convert-to-markdown/upload endpoint with all test files."""
+    print("\nTesting /api/convert-to-markdown/upload endpoint...")
+    
+    test_files = [f for f in os.listdir('test_files') if not f.startswith('.')]
+    for file in test_files:
+        print(f"\nUploading {file}...")
+        
+        file_path = os.path.join('test_files', file)
+        mime_type = mimetypes.guess_type(file)[0] or "application/octet-stream"
+        with open(file_path, 'rb') as f:
+            async with httpx.AsyncClient(timeout=300) as client:
+                response = await client.post(
+                    f"{API_URL}/api/convert-to-markdown/upload",
+                    headers=HEADERS,
+                    files={"file": (file, f, mime_type)}
+                )
+        
+        if response.status_code == 200 and response.json().get("success"):
+            markdown_content = response.json().get("markdown", "")
+            print(f"✓ Successfully converted {file}")
+            print(f"  Output length: {len(markdown_content)} characters")
+        else:
+            print(f"✗ Failed to convert {file}")
+            print(f"  Error: {response.text}")
+
 async def main():
     """Run all tests in sequence."""
     print("\nStarting tests...")